@@ -1,51 +1,200 @@
+import time
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import Metrics
 
 class ApiBA:
-    def __init__(self, base_market_url, base_wallet_url, markets, target_wallet, vaults_url, ssr_url):
-        # This method now accepts 5 arguments plus self
+    def __init__(self, base_market_url, base_wallet_url, markets, target_wallet, vaults_url, ssr_url,
+                 max_workers=8, timeout=10, retries=3, backoff_factor=0.5,
+                 cache=None, snapshots=None, replay=None, metrics=None, session=None):
+        # This method now accepts 5 arguments plus self, and optional fetch settings
         self.base_market_url = base_market_url
         self.base_wallet_url = base_wallet_url
         self.markets = markets
         self.target_wallet = target_wallet
         self.vaults_url = vaults_url
         self.ssr_url = ssr_url
+        self.max_workers = max_workers
+        self.timeout = timeout
+        # A session passed in is shared as it is; retries and backoff_factor only apply to one built here
+        self.session = session if session is not None else self.build_session(max_workers, retries, backoff_factor)
+        # Optional ResponseCache / SnapshotStore; replay serves a stored snapshot instead of the network
+        self.cache = cache
+        self.snapshots = snapshots
+        if replay is not None and snapshots is None:
+            raise ValueError("replay needs the SnapshotStore to read from; pass snapshots=")
+        self.replay_responses = snapshots.load(replay) if replay is not None else None
+        # Stage and HTTP timings, status codes, retries and failures go to the metrics hooks
+        self.metrics = metrics or Metrics()
+        self.responses = {}
+        self.snapshot = None
+        self.positions = {}
         self.data = []
 
+    @staticmethod
+    def build_session(max_workers, retries, backoff_factor):
+        # One keep-alive connection pool shared by every call, retrying transient failures with backoff
+        retry = Retry(total=retries, backoff_factor=backoff_factor,
+                      status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=frozenset(['GET']), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    @staticmethod
+    def with_query(url, **params):
+        # Same endpoint with some of its query parameters set
+        parts = urlsplit(url)
+        query = dict(parse_qsl(parts.query))
+        query.update({key: str(value) for key, value in params.items()})
+        return urlunsplit(parts._replace(query=urlencode(query)))
+
+    @staticmethod
+    def historic_url(url, days_ago):
+        return ApiBA.with_query(url, days_ago=days_ago)
+
+    def get(self, url):
+        return self.session.get(url, timeout=self.timeout)
+
+    @staticmethod
+    def retries_made(response):
+        # urllib3 keeps the Retry state of the final response; its history has one entry per retry
+        retries = getattr(response.raw, 'retries', None)
+        return len(retries.history) if retries is not None else 0
+
+    def get_json(self, endpoint, url, record=True):
+        # Parsed body of a successful call, or None; served from the replay snapshot or cache when possible.
+        # record=False keeps the payload out of the response log and the cache, for bulk pulls such as history.
+        if self.replay_responses is not None:
+            return self.replay_responses.get(url)
+        if self.cache is not None:
+            payload = self.cache.get(endpoint, url)
+            if payload is not None:
+                self.metrics.event('cache_hit', endpoint=endpoint)
+                if record:
+                    self.responses[url] = payload
+                return payload
+        start = time.perf_counter()
+        try:
+            response = self.get(url)
+        except requests.RequestException:
+            self.metrics.request(endpoint, 'error', time.perf_counter() - start)
+            raise
+        self.metrics.request(endpoint, response.status_code, time.perf_counter() - start,
+                             len(response.content), self.retries_made(response))
+        if response.status_code != 200:
+            return None
+        payload = response.json()
+        if record:
+            if self.cache is not None:
+                self.cache.set(endpoint, url, payload)
+            self.responses[url] = payload
+        return payload
+
+    # Single-market lookup on the top suppliers page; fetch_data reads the positions index instead
     def fetch_wallet_supply(self, market_id):
         url = self.base_wallet_url.format(market_id)
-        response = requests.get(url)
-        if response.status_code == 200:
-            wallets = response.json()['results']
+        payload = self.get_json('wallet', url)
+        if payload is not None:
+            wallets = payload['results']
             for wallet in wallets:
                 if wallet['wallet_address'] == self.target_wallet:
                     return wallet['supply']
         return 0
 
+    def fetch_vault_positions(self, vaults_url=None, record=True):
+        # Every market of the vault from the paginated vault pools endpoint, indexed by market uid.
+        # Pages are followed through 'next' when the API sends it, otherwise while pages come back full.
+        # Returns None when any page fails, so a partial index is never read as zero supply.
+        start = time.perf_counter()
+        url = vaults_url or self.vaults_url
+        page_size = int(dict(parse_qsl(urlsplit(url).query)).get('p_size', 0))
+        page = int(dict(parse_qsl(urlsplit(url).query)).get('p', 1))
+        positions = {}
+        while url:
+            try:
+                payload = self.get_json('vault', url, record)
+            except requests.RequestException:
+                payload = None
+            if payload is None:
+                self.metrics.event('positions_fetch_failed', page=page)
+                print(f"Failed to fetch vault positions page {page}")
+                positions = None
+                break
+            results = payload.get('results')
+            if not results:
+                break
+            known = len(positions)
+            for item in results:
+                positions[item['market_uid']] = item
+            # Stop once the API's count is reached, or on a page with nothing new: an endpoint that
+            # ignores the page number would otherwise serve the same markets forever
+            count = payload.get('count')
+            if len(positions) == known or (count is not None and len(positions) >= count):
+                break
+            if 'next' in payload:
+                url = payload['next']
+                page += 1
+            elif page_size and len(results) == page_size:
+                page += 1
+                url = self.with_query(url, p=page)
+            else:
+                url = None
+        self.metrics.stage('fetch_positions', time.perf_counter() - start,
+                           len(positions) if positions is not None else None)
+        return positions
+
     def fetch_vault_caps(self):
-        response = requests.get(self.vaults_url)
-        if response.status_code == 200:
-            return {item['market_uid']: item['cap'] for item in response.json()['results']}
-        return {}
+        positions = self.fetch_vault_positions()
+        if positions is None:
+            return None
+        return {market: item['cap'] for market, item in positions.items()}
 
-    def fetch_ssr_rate(self):
+    def fetch_ssr_rate(self, record=True):
         # New method to fetch SSR rate
-        response = requests.get(self.ssr_url)
-        if response.status_code == 200:
-            return response.json().get("ssr_rate")
+        payload = self.get_json('ssr', self.ssr_url, record)
+        if payload is not None:
+            return payload.get("ssr_rate")
         return None
 
+    def fetch_market(self, market):
+        # Returns the market payload, or None if the market call failed
+        market_url = self.base_market_url.format(market)
+        try:
+            payload = self.get_json('market', market_url)
+        except requests.RequestException:
+            return None
+        if payload is None:
+            return None
+        return payload[0]
+
     def fetch_data(self):
-        vault_caps = self.fetch_vault_caps()
-        ssr_rate = self.fetch_ssr_rate()
-
-        for market in self.markets:
-            market_url = self.base_market_url.format(market)
-            market_response = requests.get(market_url)
-            if market_response.status_code == 200:
-                market_data = market_response.json()[0]
-                maker_allocation = self.fetch_wallet_supply(market)
-                cap = vault_caps.get(market, None)
-                
+        start = time.perf_counter()
+        markets = list(self.markets)
+        self.responses = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # The vault's supply and cap in every market come from one paginated positions pull
+            positions_future = executor.submit(self.fetch_vault_positions)
+            ssr_rate_future = executor.submit(self.fetch_ssr_rate)
+            # map keeps the results in the same order as self.markets
+            results = list(executor.map(self.fetch_market, markets))
+            self.positions = positions_future.result()
+            ssr_rate = ssr_rate_future.result()
+
+        for market, market_data in zip(markets, results):
+            # A market missing from the positions index has no known supply; it fails like a failed call
+            position = self.positions.get(market) if self.positions is not None else None
+            if market_data is not None and position is not None:
+                maker_allocation = position.get('supply', 0)
+                cap = position.get('cap', None)
+
                 combined_data = {
                     "market": market,
                     "total_supply": market_data["total_supply"],
@@ -56,7 +205,15 @@ class ApiBA:
                     "ssr_rate": ssr_rate
                 }
                 self.data.append(combined_data)
-            else:
+            elif market_data is None:
+                self.metrics.event('market_fetch_failed', market=market, reason='market')
                 print(f"Failed to fetch data for market {market}")
+            else:
+                self.metrics.event('market_fetch_failed', market=market, reason='positions')
+                print(f"Failed to fetch vault position for market {market}")
+
+        if self.snapshots is not None and self.replay_responses is None:
+            self.snapshot = self.snapshots.save(self.responses)
 
-        return self.data
\ No newline at end of file
+        self.metrics.stage('fetch', time.perf_counter() - start, len(self.data))
+        return self.data
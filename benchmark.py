@@ -0,0 +1,287 @@
+import argparse
+import contextlib
+import io
+import json
+import platform
+import statistics
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from api import ApiBA
+from data_manipulation import (IDLE_COLUMNS, POOL_COLUMNS, PoolAnalysis, PoolDataHandler, PoolOverview,
+                               set_statuses, set_vault_parameters)
+from metrics import Metrics, MetricsRecorder
+from pool_engine import OVERVIEW_METRICS
+
+SIZES = [15, 100, 1000, 10000]
+STAGES = ['fetch', 'populate', 'analysis', 'overview']
+
+ASSETS = ['USDe', 'sUSDe', 'PT-sUSDe-27Mar2025', 'PT-USDe-27Mar2025', 'PT-eUSDE-29MAY2025']
+LLTVS = ['77%', '86%', '91.5%', '94.50%']
+TARGET_WALLET = '0x73e65dbd630f90604062f6e02fab9138e713edd9'
+# Supply cap the API reports for the idle market
+UINT_CAP = 2 ** 184 - 1
+
+# Tweakable parameters and metaparameters as set in the notebook
+PARAMETERS = {
+    'Fixed Spread': 1.75 / 100,
+    'Fixed Slope per 100M': 0.65 / 100,
+    'Proportional Spread': 50 / 100,
+    'Proportional Slope per 100M': 3 / 100,
+    'Low Target Threshold': 80 / 100,
+    'High Target Threshold': 105 / 100,
+}
+REALLOC_METAPARM = {
+    'active_pool': {'min_balance': 10000000, 'max_utilization': 0.9, 'max_portion_to_withdraw': 0.1,
+                    'allocation_significance_threshold': 10000},
+    'inactive_pool': {'min_balance': 100000, 'max_utilization': 0.93, 'max_portion_to_withdraw': 1,
+                      'allocation_significance_threshold': 10000},
+}
+
+
+def synthetic_markets(n_markets, seed=0):
+    """A vault of `n_markets` markets plus the idle market, with Blockanalitica-shaped payloads.
+
+    Supplies are log-normal around 50M, utilization sits mostly between 70% and 95%, and the vault
+    holds 5-90% of each market under a cap 1-2x its allocation. Values are sent as decimal strings,
+    the way the API sends them.
+    """
+    rng = np.random.default_rng(seed)
+    uids = [rng.bytes(32).hex() for _ in range(n_markets + 1)]
+    idle_uid = uids.pop()
+
+    total_supply = np.round(rng.lognormal(np.log(50e6), 1.0, n_markets), 6)
+    utilization = np.clip(rng.beta(8, 1.5, n_markets), 0.05, 0.999)
+    borrow_rate = np.round(0.02 + 0.12 * utilization + rng.normal(0, 0.01, n_markets), 6).clip(0.001)
+    maker_allocation = np.round(total_supply * rng.uniform(0.05, 0.9, n_markets), 6)
+    supply_cap = np.round(maker_allocation * rng.uniform(1.0, 2.0, n_markets))
+    idle_supply = round(float(total_supply.sum()) * 0.02, 6)
+
+    market_to_pool = {uid: f'{ASSETS[i % len(ASSETS)]} {LLTVS[i // len(ASSETS) % len(LLTVS)]} #{i}'
+                      for i, uid in enumerate(uids)}
+    markets = {uid: [{'total_supply': str(total_supply[i]), 'utilization': str(utilization[i]),
+                      'borrow_rate_apy': str(borrow_rate[i])}]
+               for i, uid in enumerate(uids)}
+    markets[idle_uid] = [{'total_supply': str(idle_supply), 'utilization': '0', 'borrow_rate_apy': '0'}]
+    positions = [{'market_uid': uid, 'supply': str(maker_allocation[i]), 'cap': str(supply_cap[i])}
+                 for i, uid in enumerate(uids)]
+    positions.append({'market_uid': idle_uid, 'supply': str(idle_supply), 'cap': str(UINT_CAP)})
+    wallets = {position['market_uid']: [{'wallet_address': TARGET_WALLET, 'supply': position['supply']}]
+               for position in positions}
+    statuses = {pool_key: 'Active' if active else 'Inactive'
+                for pool_key, active in zip(market_to_pool.values(), rng.random(n_markets) < 0.8)}
+
+    return {
+        'market_to_pool': market_to_pool,
+        'idle_market_to_pool': {idle_uid: 'Idle'},
+        'statuses': statuses,
+        'markets': markets,
+        'positions': positions,
+        'wallets': wallets,
+        'ssr_rate': '0.0625',
+    }
+
+
+# Local stand-in for the Blockanalitica market, wallet, vault pools and SSR endpoints, serving a
+# synthetic_markets() vault with `latency` seconds added to every response
+class StubApiServer:
+    def __init__(self, vault, latency=0.0, host='127.0.0.1', port=0):
+        self.vault = vault
+        self.latency = latency
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        self.url = 'http://%s:%d' % self.server.server_address[:2]
+        self.thread = None
+
+    @property
+    def base_market_url(self):
+        return self.url + '/markets/{}/historic/?days_ago=0&network=ethereum'
+
+    @property
+    def base_wallet_url(self):
+        return self.url + '/markets/{}/wallets/?network=ethereum&order=-supply&p_size=4&type=suppliers'
+
+    @property
+    def vaults_url(self):
+        return self.url + f'/vaults/{TARGET_WALLET}/pools/?days_ago=0&network=ethereum&order=-supply_usd&p=1&p_size=15'
+
+    @property
+    def ssr_url(self):
+        return self.url + '/save/'
+
+    def api(self, markets, **kwargs):
+        return ApiBA(self.base_market_url, self.base_wallet_url, markets, TARGET_WALLET, self.vaults_url,
+                     self.ssr_url, **kwargs)
+
+    def respond(self, path, query):
+        # JSON body for a request path, or None for a 404
+        parts = path.strip('/').split('/')
+        if len(parts) == 3 and parts[0] == 'markets' and parts[2] == 'historic':
+            return self.vault['markets'].get(parts[1])
+        if len(parts) == 3 and parts[0] == 'markets' and parts[2] == 'wallets':
+            if parts[1] not in self.vault['wallets']:
+                return None
+            return {'count': 1, 'next': None, 'previous': None, 'results': self.vault['wallets'][parts[1]]}
+        if len(parts) == 3 and parts[0] == 'vaults' and parts[2] == 'pools':
+            page, page_size = int(query.get('p', 1)), int(query.get('p_size', 15))
+            positions = self.vault['positions']
+            results = positions[(page - 1) * page_size:page * page_size]
+            more = page * page_size < len(positions)
+            next_url = ApiBA.with_query(self.url + path, **dict(query, p=page + 1)) if more else None
+            return {'count': len(positions), 'next': next_url, 'previous': None, 'results': results}
+        if parts == ['save']:
+            return {'ssr_rate': self.vault['ssr_rate']}
+        return None
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if stub.latency:
+                    time.sleep(stub.latency)
+                parts = urlsplit(self.path)
+                body = stub.respond(parts.path, dict(parse_qsl(parts.query)))
+                payload = json.dumps(body).encode() if body is not None else b'{"detail": "Not found."}'
+                self.send_response(200 if body is not None else 404)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def run_pipeline(server, vault, metrics, max_workers=8):
+    # The notebook's refresh: fetch, populate, analyse and summarise, reporting each stage to `metrics`
+    market_to_pool = vault['market_to_pool']
+    idle_market_to_pool = vault['idle_market_to_pool']
+    data = server.api(market_to_pool.keys(), max_workers=max_workers, metrics=metrics).fetch_data()
+    idle_data = server.api(idle_market_to_pool.keys(), max_workers=max_workers).fetch_data()
+
+    pools_df = pd.DataFrame(index=list(market_to_pool.values()), columns=POOL_COLUMNS)
+    idle_df = pd.DataFrame(index=list(idle_market_to_pool.values()), columns=IDLE_COLUMNS)
+    with contextlib.redirect_stdout(io.StringIO()):
+        pools_df = PoolDataHandler(pools_df, market_to_pool, metrics).populate_dataframe(data)
+        idle_df = PoolDataHandler(idle_df, idle_market_to_pool).populate_dataframe(idle_data)
+    set_statuses(pools_df, vault['statuses'])
+    set_vault_parameters(pools_df, PARAMETERS)
+
+    pool_df = PoolAnalysis(pools_df, idle_df, REALLOC_METAPARM, metrics).update_pool_dataframe()
+    pool_overview = pd.DataFrame(index=OVERVIEW_METRICS, columns=['Current', 'Future', 'Change'])
+    PoolOverview(pool_df, pool_overview, metrics).update_pool_overview()
+
+
+def benchmark(n_markets, repeats=3, latency=0.005, max_workers=8, seed=0):
+    """Timings of every stage for one vault size; one record per stage."""
+    vault = synthetic_markets(n_markets, seed)
+    seconds = {stage: [] for stage in STAGES}
+    rows = {}
+    requests = 0
+    with StubApiServer(vault, latency) as server:
+        for _ in range(repeats):
+            recorder = MetricsRecorder()
+            run_pipeline(server, vault, Metrics([recorder]), max_workers)
+            for stage in STAGES:
+                seconds[stage].append(recorder.stages[stage]['last_seconds'])
+                rows[stage] = recorder.stages[stage]['rows']
+            requests = sum(totals['count'] for totals in recorder.requests.values())
+
+    records = []
+    for stage in STAGES:
+        record = {
+            'stage': stage,
+            'markets': n_markets,
+            'repeats': repeats,
+            'rows': rows[stage],
+            'min_seconds': min(seconds[stage]),
+            'median_seconds': statistics.median(seconds[stage]),
+            'max_seconds': max(seconds[stage]),
+        }
+        if stage == 'fetch':
+            record.update({'latency_seconds': latency, 'max_workers': max_workers, 'requests': requests})
+        records.append(record)
+    return records
+
+
+def run_benchmarks(sizes=SIZES, repeats=3, latency=0.005, max_workers=8, seed=0):
+    """Every stage at every size, with the environment, as one JSON-serialisable report."""
+    results = []
+    for n_markets in sizes:
+        results.extend(benchmark(n_markets, repeats, latency, max_workers, seed))
+    return {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'seed': seed,
+        'results': results,
+    }
+
+
+def compare_reports(baseline, report, tolerance=0.25):
+    # (stage, markets, baseline, current) for every stage whose median got more than `tolerance` slower
+    previous = {(r['stage'], r['markets']): r['median_seconds'] for r in baseline['results']}
+    regressions = []
+    for record in report['results']:
+        key = (record['stage'], record['markets'])
+        if key in previous and record['median_seconds'] > previous[key] * (1 + tolerance):
+            regressions.append((record['stage'], record['markets'], previous[key], record['median_seconds']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the fetch, populate, analysis and overview stages.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='numbers of markets')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.005, help='seconds added to every stub response')
+    parser.add_argument('--max-workers', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_output.txt', help='JSON report path')
+    parser.add_argument('--baseline', help='earlier JSON report to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.sizes, args.repeats, args.latency, args.max_workers, args.seed)
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+
+    for record in report['results']:
+        print(f"{record['stage']:>9} {record['markets']:>6} markets  {record['median_seconds'] * 1000:10.2f} ms")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare_reports(json.load(file), report, args.tolerance)
+        for stage, n_markets, before, after in regressions:
+            print(f"Regression: {stage} at {n_markets} markets {before * 1000:.2f} ms -> {after * 1000:.2f} ms")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,102 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+# Seconds a response stays fresh, per Blockanalitica endpoint
+DEFAULT_TTLS = {
+    'market': 60,
+    'wallet': 60,
+    'vault': 300,
+    'ssr': 3600,
+}
+
+# Microseconds keep back-to-back fetches apart; save() adds a counter if a name is still taken
+SNAPSHOT_FORMAT = '%Y%m%dT%H%M%S.%fZ'
+
+
+# In-memory response cache with a TTL per endpoint and LRU eviction
+class ResponseCache:
+    def __init__(self, ttls=None, max_entries=1024):
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, endpoint, url):
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                return None
+            stored_at, payload = entry
+            if time.monotonic() - stored_at > self.ttls.get(endpoint, 0):
+                del self.entries[url]
+                return None
+            self.entries.move_to_end(url)
+            return payload
+
+    def set(self, endpoint, url, payload):
+        if self.ttls.get(endpoint, 0) <= 0:
+            return
+        with self.lock:
+            self.entries[url] = (time.monotonic(), payload)
+            self.entries.move_to_end(url)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+# On-disk snapshots of every response of a fetch, replayable by timestamp
+class SnapshotStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, timestamp):
+        return os.path.join(self.directory, f'{timestamp}.json')
+
+    def timestamps(self):
+        return sorted(name[:-5] for name in os.listdir(self.directory) if name.endswith('.json'))
+
+    def resolve(self, timestamp=None):
+        # Latest snapshot taken at or before the timestamp (or the latest overall)
+        timestamps = self.timestamps()
+        if timestamp is not None:
+            if isinstance(timestamp, datetime):
+                timestamp = timestamp.astimezone(timezone.utc).strftime(SNAPSHOT_FORMAT)
+            timestamps = [ts for ts in timestamps if ts <= timestamp]
+        if not timestamps:
+            raise KeyError(f"No snapshot at or before {timestamp} in {self.directory}")
+        return timestamps[-1]
+
+    def reserve(self, timestamp):
+        # First free name for the timestamp, claimed by creating its temporary file; never overwrites a snapshot
+        with self.lock:
+            name, counter = timestamp, 0
+            while True:
+                try:
+                    if not os.path.exists(self.path(name)):
+                        return name, open(self.path(name) + '.tmp', 'x')
+                except FileExistsError:
+                    pass
+                counter += 1
+                name = f'{timestamp}-{counter}'
+
+    def save(self, responses, timestamp=None):
+        if timestamp is None:
+            timestamp = datetime.now(timezone.utc).strftime(SNAPSHOT_FORMAT)
+        timestamp, file = self.reserve(timestamp)
+        with file:
+            json.dump(responses, file)
+        os.replace(self.path(timestamp) + '.tmp', self.path(timestamp))
+        return timestamp
+
+    def load(self, timestamp=None):
+        with open(self.path(self.resolve(timestamp))) as file:
+            return json.load(file)
@@ -0,0 +1,145 @@
+import json
+from decimal import Decimal
+
+import numpy as np
+
+WAD = 10 ** 18
+UINT256_MAX = 2 ** 256 - 1
+# Allocation of the closing idle entry: everything left over goes to the idle market
+IDLE_ALLOCATION = '0x' + 'f' * 64
+
+REALLOCATE_SIGNATURE = 'reallocate(((address,address,address,address,uint256),uint256)[])'
+
+
+# Keccak-256 as used by Ethereum (not the NIST SHA3-256 padding), for the function selector
+KECCAK_ROUND_CONSTANTS = [
+    0x0000000000000001, 0x0000000000008082, 0x800000000000808A, 0x8000000080008000,
+    0x000000000000808B, 0x0000000080000001, 0x8000000080008081, 0x8000000000008009,
+    0x000000000000008A, 0x0000000000000088, 0x0000000080008009, 0x000000008000000A,
+    0x000000008000808B, 0x800000000000008B, 0x8000000000008089, 0x8000000000008003,
+    0x8000000000008002, 0x8000000000000080, 0x000000000000800A, 0x800000008000000A,
+    0x8000000080008081, 0x8000000000008080, 0x0000000080000001, 0x8000000080008008,
+]
+KECCAK_ROTATIONS = [
+    [0, 36, 3, 41, 18], [1, 44, 10, 45, 2], [62, 6, 43, 15, 61], [28, 55, 25, 21, 56], [27, 20, 39, 8, 14],
+]
+MASK_64 = 2 ** 64 - 1
+
+
+def keccak_f(state):
+    for round_constant in KECCAK_ROUND_CONSTANTS:
+        c = [state[x][0] ^ state[x][1] ^ state[x][2] ^ state[x][3] ^ state[x][4] for x in range(5)]
+        d = [c[(x - 1) % 5] ^ (((c[(x + 1) % 5] << 1) | (c[(x + 1) % 5] >> 63)) & MASK_64) for x in range(5)]
+        state = [[state[x][y] ^ d[x] for y in range(5)] for x in range(5)]
+        b = [[0] * 5 for _ in range(5)]
+        for x in range(5):
+            for y in range(5):
+                r = KECCAK_ROTATIONS[x][y]
+                b[y][(2 * x + 3 * y) % 5] = ((state[x][y] << r) | (state[x][y] >> (64 - r))) & MASK_64 if r else state[x][y]
+        state = [[b[x][y] ^ ((~b[(x + 1) % 5][y]) & b[(x + 2) % 5][y]) for y in range(5)] for x in range(5)]
+        state[0][0] ^= round_constant
+    return state
+
+
+def keccak256(data):
+    rate = 136
+    if len(data) % rate == rate - 1:
+        padded = bytearray(data) + b'\x81'
+    else:
+        padded = bytearray(data) + b'\x01' + b'\x00' * ((-len(data) - 2) % rate) + b'\x80'
+    state = [[0] * 5 for _ in range(5)]
+    for start in range(0, len(padded), rate):
+        block = padded[start:start + rate]
+        for i in range(rate // 8):
+            state[i % 5][i // 5] ^= int.from_bytes(block[8 * i:8 * i + 8], 'little')
+        state = keccak_f(state)
+    return b''.join(state[i % 5][i // 5].to_bytes(8, 'little') for i in range(4))
+
+
+REALLOCATE_SELECTOR = keccak256(REALLOCATE_SIGNATURE.encode())[:4]
+
+
+def to_wei(amount):
+    # Exact integer wei for a token amount; integral amounts never go through a float
+    if isinstance(amount, (int, np.integer)):
+        return int(amount) * WAD
+    return int(Decimal(str(amount)) * WAD)
+
+
+def lltv_wei(pool_key):
+    # '91.5%' in the pool name -> 915000000000000000 (percent times 10**16)
+    parts = pool_key.split()
+    if len(parts) < 2:
+        return 0
+    return int(Decimal(parts[1].replace('%', '')) * 10 ** 16)
+
+
+def encode_word(value):
+    if isinstance(value, str) and value.startswith('0x'):
+        value = int(value, 16)
+    return int(value).to_bytes(32, 'big')
+
+
+# Turns Final Allocation columns into reallocate() payloads for one vault.
+# `base_addresses` maps the asset of each pool name (its first word) to the loan token, collateral
+# token, oracle and IRM addresses, with an 'Idle' entry for the idle market, as in the notebook.
+class ReallocationBuilder:
+    def __init__(self, pool_keys, base_addresses):
+        self.pool_keys = list(pool_keys)
+        self.base_addresses = base_addresses
+        self.market_params = [self.pool_market_params(pool_key) for pool_key in self.pool_keys]
+        self.idle_params = list(base_addresses['Idle']) + ['0']
+        # Market params never change, so their ABI words are encoded once per pool
+        self.encoded_params = [b''.join(encode_word(value) for value in params) for params in self.market_params]
+        self.encoded_idle_params = b''.join(encode_word(value) for value in self.idle_params)
+
+    def pool_market_params(self, pool_key):
+        asset_type = pool_key.split()[0]
+        addresses = self.base_addresses.get(asset_type, self.base_addresses['Idle'])
+        return list(addresses) + [str(lltv_wei(pool_key))]
+
+    def ordered_pools(self, total_change):
+        # Pools that move, withdrawals first so the supplies have liquidity to draw on
+        withdrawals = [i for i, change in enumerate(total_change) if change < 0]
+        supplies = [i for i, change in enumerate(total_change) if change > 0]
+        return withdrawals + supplies
+
+    def entries(self, final_allocation, total_change):
+        # [[market params], allocation wei] per moving pool, then the idle market catch-all
+        output = [[self.market_params[i], str(to_wei(final_allocation[i]))]
+                  for i in self.ordered_pools(total_change)]
+        output.append([self.idle_params, IDLE_ALLOCATION])
+        return output
+
+    def json(self, final_allocation, total_change):
+        # Same layout as morpho_vault_realloc.json
+        return json.dumps(self.entries(final_allocation, total_change), indent=2)
+
+    def calldata(self, final_allocation, total_change):
+        # ABI-encoded reallocate(MarketAllocation[]) call; every tuple is static, so the array is
+        # an offset word, a length word and six words per allocation
+        order = self.ordered_pools(total_change)
+        parts = [REALLOCATE_SELECTOR, encode_word(32), encode_word(len(order) + 1)]
+        for i in order:
+            parts.append(self.encoded_params[i])
+            parts.append(encode_word(to_wei(final_allocation[i])))
+        parts.append(self.encoded_idle_params)
+        parts.append(encode_word(UINT256_MAX))
+        return '0x' + b''.join(parts).hex()
+
+    def batch(self, final_allocations, maker_allocation, output='calldata'):
+        # One payload per row of a (scenarios x pools) Final Allocation array, e.g. from a sweep
+        final_allocations = np.atleast_2d(final_allocations)
+        changes = final_allocations - np.asarray(maker_allocation)
+        build = self.calldata if output == 'calldata' else self.json
+        return [build(final_allocation, change) for final_allocation, change in zip(final_allocations, changes)]
+
+
+def build_reallocations(vaults, base_addresses, output='calldata'):
+    """Payload per vault; `vaults` maps a vault name to its analysed pool frame."""
+    payloads = {}
+    for vault, pool_df in vaults.items():
+        builder = ReallocationBuilder(pool_df.index, base_addresses)
+        build = builder.calldata if output == 'calldata' else builder.json
+        payloads[vault] = build(pool_df['Final Allocation'].tolist(), pool_df['Total Change'].tolist())
+    return payloads
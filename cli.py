@@ -0,0 +1,192 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+# pandas, numpy, requests and the analysis modules are imported on first use, so that --help and
+# --check-config return immediately and a service only pays for the imports once
+
+REQUIRED_KEYS = ['base_market_url', 'base_wallet_url', 'vaults_url', 'ssr_url', 'target_wallet',
+                 'market_to_pool', 'idle_market_to_pool', 'statuses', 'parameters', 'realloc_metaparm',
+                 'base_addresses']
+
+
+def load_config(path):
+    """Read and check a JSON config; see config.example.json for every key."""
+    with open(path) as file:
+        config = json.load(file)
+    missing = [key for key in REQUIRED_KEYS if key not in config]
+    if missing:
+        raise ValueError(f"Config {path} is missing: {', '.join(missing)}")
+    unknown = set(config['statuses']) - set(config['market_to_pool'].values())
+    if unknown:
+        raise ValueError(f"Statuses given for pools not in market_to_pool: {', '.join(sorted(unknown))}")
+    bad = {pool: status for pool, status in config['statuses'].items() if status not in ('Active', 'Inactive')}
+    if bad:
+        raise ValueError(f"Status must be 'Active' or 'Inactive': {bad}")
+    config.setdefault('output_dir', 'output')
+    config.setdefault('interval', 300)
+    config.setdefault('fetch', {})
+    return config
+
+
+def write_atomic(path, text):
+    # Readers of the output directory never see a half-written file
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as file:
+        file.write(text)
+    os.replace(temporary, path)
+
+
+# Runs the notebook workflow without prompts: fetch, populate, set statuses and parameters,
+# analyse, summarise and write the reallocate() JSON. The API session is kept between runs, so a
+# service keeps its connections warm.
+class Reallocator:
+    def __init__(self, config, metrics=None):
+        from api import ApiBA
+        from cache import ResponseCache
+        from metrics import Metrics
+
+        self.config = config
+        self.metrics = metrics or Metrics()
+        # Only shares the positions and SSR pages between the two ApiBA of one run; cleared every run
+        self.cache = ResponseCache()
+        settings = config['fetch']
+        self.api = ApiBA(config['base_market_url'], config['base_wallet_url'], list(config['market_to_pool']),
+                         config['target_wallet'], config['vaults_url'], config['ssr_url'], cache=self.cache,
+                         metrics=self.metrics, **settings)
+        self.idle_api = ApiBA(config['base_market_url'], config['base_wallet_url'],
+                              list(config['idle_market_to_pool']), config['target_wallet'], config['vaults_url'],
+                              config['ssr_url'], cache=self.cache, metrics=self.metrics,
+                              session=self.api.session, **settings)
+
+    def fetch(self):
+        # ApiBA.fetch_data appends to .data, so every run starts from an empty list and fresh pages
+        self.cache.clear()
+        self.api.data = []
+        self.idle_api.data = []
+        return self.api.fetch_data(), self.idle_api.fetch_data()
+
+    def analyse(self, data, idle_data):
+        """(pool table, overview, reallocate entries) for fetched ApiBA records."""
+        import contextlib
+        import io
+
+        import pandas as pd
+
+        from calldata import ReallocationBuilder
+        from data_manipulation import (IDLE_COLUMNS, POOL_COLUMNS, PoolAnalysis, PoolDataHandler, PoolOverview,
+                                       set_statuses, set_vault_parameters)
+        from pool_engine import OVERVIEW_METRICS
+
+        config = self.config
+        market_to_pool = config['market_to_pool']
+        idle_market_to_pool = config['idle_market_to_pool']
+        pools_df = pd.DataFrame(index=list(market_to_pool.values()), columns=POOL_COLUMNS)
+        idle_df = pd.DataFrame(index=list(idle_market_to_pool.values()), columns=IDLE_COLUMNS)
+        # populate_dataframe prints for the notebook; nothing goes to stdout here
+        with contextlib.redirect_stdout(io.StringIO()):
+            pools_df = PoolDataHandler(pools_df, market_to_pool, self.metrics).populate_dataframe(data)
+            idle_df = PoolDataHandler(idle_df, idle_market_to_pool).populate_dataframe(idle_data)
+        set_statuses(pools_df, config['statuses'])
+        set_vault_parameters(pools_df, config['parameters'])
+
+        pool_df = PoolAnalysis(pools_df, idle_df, config['realloc_metaparm'], self.metrics).update_pool_dataframe()
+        pool_overview = pd.DataFrame(index=OVERVIEW_METRICS, columns=['Current', 'Future', 'Change'])
+        pool_overview = PoolOverview(pool_df, pool_overview, self.metrics).update_pool_overview()
+
+        builder = ReallocationBuilder(pool_df.index, config['base_addresses'])
+        entries = builder.entries(pool_df['Final Allocation'].tolist(), pool_df['Total Change'].tolist())
+        return pool_df, pool_overview, entries
+
+    def write(self, pool_df, pool_overview, entries):
+        output_dir = self.config['output_dir']
+        os.makedirs(output_dir, exist_ok=True)
+        paths = {
+            'allocation': os.path.join(output_dir, 'allocation.csv'),
+            'overview': os.path.join(output_dir, 'overview.csv'),
+            'reallocate': os.path.join(output_dir, 'morpho_vault_realloc.json'),
+        }
+        write_atomic(paths['allocation'], pool_df.to_csv())
+        write_atomic(paths['overview'], pool_overview.to_csv())
+        write_atomic(paths['reallocate'], json.dumps(entries, indent=2))
+        return paths
+
+    def run_once(self):
+        with self.metrics.timed('run') as record:
+            data, idle_data = self.fetch()
+            pool_df, pool_overview, entries = self.analyse(data, idle_data)
+            paths = self.write(pool_df, pool_overview, entries)
+            record['rows'] = len(pool_df)
+        return paths
+
+
+def serve(reallocator, interval, metrics_file=None, recorder=None, max_runs=None):
+    # Runs start on a fixed grid of `interval` seconds; a run that overruns skips the ticks it missed
+    # instead of queueing them, so the start times stay predictable
+    start = time.monotonic()
+    runs = 0
+    while True:
+        try:
+            paths = reallocator.run_once()
+            print(f"{time.strftime('%Y-%m-%dT%H:%M:%S')} wrote {paths['reallocate']}", flush=True)
+        except Exception as error:
+            reallocator.metrics.event('run_failed', error=type(error).__name__)
+            print(f"{time.strftime('%Y-%m-%dT%H:%M:%S')} run failed: {error!r}", file=sys.stderr, flush=True)
+        if metrics_file and recorder is not None:
+            write_atomic(metrics_file, recorder.to_prometheus())
+        runs += 1
+        if max_runs is not None and runs >= max_runs:
+            break
+        elapsed = time.monotonic() - start
+        time.sleep(interval - elapsed % interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fetch, analyse and write the Morpho vault reallocation.')
+    parser.add_argument('config', help='JSON config file, see config.example.json')
+    parser.add_argument('--serve', action='store_true', help='keep running, once every --interval seconds')
+    parser.add_argument('--interval', type=float, help='seconds between runs (default: config interval)')
+    parser.add_argument('--output-dir', help='where to write the outputs (default: config output_dir)')
+    parser.add_argument('--metrics-file', help='write Prometheus text metrics here after every run')
+    parser.add_argument('--check-config', action='store_true', help='only validate the config')
+    args = parser.parse_args(argv)
+
+    try:
+        config = load_config(args.config)
+    except (OSError, ValueError) as error:
+        print(f"Error: {error}", file=sys.stderr)
+        return 2
+    if args.check_config:
+        print(f"{args.config}: {len(config['market_to_pool'])} pools, config OK")
+        return 0
+    if args.output_dir:
+        config['output_dir'] = args.output_dir
+
+    from metrics import Metrics, MetricsRecorder
+    recorder = MetricsRecorder()
+    reallocator = Reallocator(config, Metrics([recorder]))
+
+    if args.serve:
+        try:
+            serve(reallocator, args.interval or config['interval'], args.metrics_file, recorder)
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    try:
+        paths = reallocator.run_once()
+    except Exception as error:
+        print(f"Error: run failed: {error!r}", file=sys.stderr)
+        return 1
+    finally:
+        if args.metrics_file:
+            write_atomic(args.metrics_file, recorder.to_prometheus())
+    for name, path in paths.items():
+        print(f"{name}: {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
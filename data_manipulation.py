@@ -1,51 +1,176 @@
+import time
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+import irm
+from metrics import Metrics
+from pool_engine import (INPUT_COLUMNS, OVERVIEW_COLUMNS, OVERVIEW_METRICS, OVERVIEW_TERMS, compute_change,
+                         compute_pool_columns, overview_table, overview_terms, round_half_even)
+
+# Columns filled from the ApiBA records: (column, record key, dtype, decimals kept)
+POOL_SCHEMA = [
+    ('Total Supply', 'total_supply', np.int64, 0),
+    ('Maker Allocation', 'maker_allocation', np.int64, 0),
+    ('Utilization', 'utilization', np.float64, 4),
+    ('Borrow Rate', 'borrow_rate', np.float64, 4),
+    ('Supply Cap', 'supply_cap', np.int64, 0),
+    ('SSR', 'ssr_rate', np.float64, 4),
+]
+
+STATUSES = ['Active', 'Inactive']
+
+# Column layout of the pool and idle frames, as laid out in the notebook
+POOL_COLUMNS = [
+    'Status', 'LLTV', 'Total Supply', 'Maker Allocation', 'Utilization', 'Borrow Rate', 'Supply Cap',
+    'Total Borrow', 'Maker Borrow', 'Optimal Rate', 'Capped Borrow Rate', 'SSR',
+    'Fixed Spread', 'Fixed Spread Rate Value', 'Fixed Slope per 100M', 'Fixed Slope',
+    'Proportional Spread', 'Proportional Spread Rate Value', 'Proportional Spread Fixed Value',
+    'Proportional Slope per 100M', 'Proportional Slope', 'Proportional Slope Fixed Value',
+    'Low Target Threshold', 'High Target Threshold', 'Target Borrow Rate', 'Min Borrow Rate', 'Max Borrow Rate',
+    'Utilization Where Rate Equal to SSR', 'SSR Adjustment', 'Total Supply After SSR Adjustment',
+    'Maker Supply After SSR Adjustment', 'Utilization After SSR Adjustment', 'Inactive Withdrawal',
+    'Utilization Where Rate Equal To Min Target', 'Active Withdrawal', 'Utilization Where Rate Equal To Max Target',
+    'Active Deposits', 'Manual Adjustment', 'Total Change', 'Final Allocation', 'Final Supply', 'Final Utilization',
+    'Final Borrow Rate', 'Final Capped Rate', 'Maker Borrow at Old Utilization', 'Borrow Rate Change',
+]
+IDLE_COLUMNS = ['LLTV', 'Total Supply', 'Maker Allocation', 'Utilization', 'Borrow Rate']
+
+# Pool columns the overview reads; 'sUSDe' comes from the pool name
+OVERVIEW_INPUTS = [factor for factor in dict.fromkeys(sum(OVERVIEW_TERMS.values(), ())) if factor != 'sUSDe']
+
+# Tweakable vault benchmark parameters
+VAULT_PARAMETERS = [
+    'Fixed Spread',
+    'Fixed Slope per 100M',
+    'Proportional Spread',
+    'Proportional Slope per 100M',
+    'Low Target Threshold',
+    'High Target Threshold',
+]
+
+
+def susde_flags(index):
+    # 1.0 for sUSDe pools; with a (snapshot, pool) index each distinct pool name is checked once
+    if isinstance(index, pd.MultiIndex):
+        names = index.levels[-1]
+        return np.asarray(names.str.startswith('sUSDe'), dtype=np.float64)[index.codes[-1]]
+    return np.asarray(index.str.startswith('sUSDe'), dtype=np.float64)
+
+
+def overview_columns(pool_df):
+    columns = {name: pool_df[name].to_numpy(dtype=np.float64, na_value=np.nan) for name in OVERVIEW_INPUTS}
+    columns['sUSDe'] = susde_flags(pool_df.index)
+    return columns
+
+
+def overview_term_matrix(columns):
+    # (terms, rows) array of the OVERVIEW_TERMS products; NaN counts as 0, like the pandas sums did
+    terms = np.stack(list(overview_terms(columns).values()))
+    return np.where(np.isnan(terms), 0.0, terms)
+
+
+@lru_cache(maxsize=None)
+def parse_lltv(pool_key):
+    # Extract the percentage number and convert to float
+    try:
+        parts = pool_key.split()
+        if len(parts) > 1:
+            lltv = float(parts[1].replace('%', '')) / 100
+        else:
+            lltv = 0.0
+    except ValueError:
+        lltv = 0.0
+    return lltv
+
+
 class PoolDataHandler:
-    def __init__(self, pools_df, market_to_pool):
+    def __init__(self, pools_df, market_to_pool, metrics=None):
         self.pools_df = pools_df
         self.market_to_pool = market_to_pool
+        self.metrics = metrics or Metrics()
+        # LLTV only depends on the pool name, so it is parsed once per mapping
+        self.lltv = {pool_key: parse_lltv(pool_key) for pool_key in market_to_pool.values()}
 
     def extract_lltv(self, pool_key):
-        # Extract the percentage number and convert to float
-        try:
-            parts = pool_key.split()
-            if len(parts) > 1:
-                lltv = float(parts[1].replace('%', '')) / 100
-            else:
-                lltv = 0.0
-        except ValueError:
-            lltv = 0.0
-        return lltv
+        if pool_key in self.lltv:
+            return self.lltv[pool_key]
+        return parse_lltv(pool_key)
 
     def populate_dataframe(self, data):
-        for market_data in data:
-            pool_key = self.market_to_pool[market_data['market']]
-
+        start = time.perf_counter()
+        pool_keys = [self.market_to_pool[market_data['market']] for market_data in data]
+        for pool_key in pool_keys:
+            if pool_key not in self.pools_df.index:
+                self.pools_df.loc[pool_key] = np.nan
+        rows = self.pools_df.index.get_indexer(pool_keys)
+
+        # Build each column as a typed array in one pass and assign it at once. Pools missing from
+        # `data` keep their previous values; an integer column that still has gaps, or holds values
+        # beyond int64 such as the uint184 max cap of an idle market, stays float64.
+        for column, key, dtype, decimals in POOL_SCHEMA:
             # Safely extract each value, using a default if the value is None.
-            total_supply = market_data.get('total_supply', 0.0) or 0.0
-            maker_allocation = market_data.get('maker_allocation', 0.0) or 0.0
-            utilization = market_data.get('utilization', 0.0) or 0.0
-            borrow_rate = market_data.get('borrow_rate', 0.0) or 0.0
-            supply_cap = market_data.get('supply_cap', 0.0) or 0.0  # <-- important
-            ssr_rate = market_data.get('ssr_rate', 0.0) or 0.0
-
-            self.pools_df.loc[pool_key, 'Total Supply']     = int(round(float(total_supply), 0))
-            self.pools_df.loc[pool_key, 'Maker Allocation'] = int(round(float(maker_allocation), 0))
-            self.pools_df.loc[pool_key, 'Utilization']      = round(float(utilization), 4)
-            self.pools_df.loc[pool_key, 'Borrow Rate']      = round(float(borrow_rate), 4)
-            self.pools_df.loc[pool_key, 'LLTV']             = float(self.extract_lltv(pool_key)) 
-            self.pools_df.loc[pool_key, 'Supply Cap']       = int(round(float(supply_cap), 0))
-            self.pools_df.loc[pool_key, 'SSR']              = round(float(ssr_rate), 4)
-
+            fetched = np.array([float(market_data.get(key, 0.0) or 0.0) for market_data in data], dtype=np.float64)
+            fetched = round_half_even(fetched, decimals)
+            values = self.column_values(column)
+            values[rows] = fetched
+            if dtype is np.int64 and (np.abs(values) < 2.0 ** 63).all():
+                values = values.astype(np.int64)
+            self.pools_df[column] = values
+
+        lltv = self.column_values('LLTV')
+        lltv[rows] = [self.extract_lltv(pool_key) for pool_key in pool_keys]
+        self.pools_df['LLTV'] = lltv
+
+        if 'Status' in self.pools_df.columns:
+            self.pools_df['Status'] = pd.Categorical(self.pools_df['Status'], categories=STATUSES)
+
+        self.metrics.stage('populate', time.perf_counter() - start, len(pool_keys))
         print("\nUpdated DataFrame:")
         return self.pools_df
 
+    def column_values(self, column):
+        if column in self.pools_df.columns:
+            return self.pools_df[column].to_numpy(dtype=np.float64, na_value=np.nan).copy()
+        return np.full(len(self.pools_df), np.nan)
+
+
+def python_number(value):
+    # NumPy scalar to the matching Python int or float
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def set_statuses(pools_df, statuses):
+    # Active/Inactive per pool; pools missing from `statuses` are left without a Status
+    pools_df['Status'] = pd.Categorical([statuses.get(pool_key) for pool_key in pools_df.index], categories=STATUSES)
+    return pools_df
+
+
+def set_vault_parameters(pools_df, parameters):
+    # Tweakable parameters and the indirect parameters derived from them
+    for name in VAULT_PARAMETERS:
+        pools_df[name] = parameters[name]
+
+    pools_df['Fixed Spread Rate Value'] = pools_df['SSR'] + pools_df['Fixed Spread']
+    pools_df['Fixed Slope'] = pools_df['Fixed Slope per 100M'] / 100000000
+    pools_df['Proportional Spread Rate Value'] = pools_df['SSR'] * (1 + pools_df['Proportional Spread'])
+    pools_df['Proportional Spread Fixed Value'] = pools_df['Proportional Spread Rate Value'] - pools_df['SSR']
+    pools_df['Proportional Slope'] = pools_df['Proportional Slope per 100M'] / 100000000
+    pools_df['Proportional Slope Fixed Value'] = pools_df['Proportional Spread Rate Value'] * pools_df['Proportional Slope per 100M']
+    return pools_df
+
 
 # Class for data manipulation and analysis of the pools
 class PoolAnalysis:
-    def __init__(self, pool_df, idle_df, realloc_metaparm):
+    def __init__(self, pool_df, idle_df, realloc_metaparm, metrics=None):
         self.pool_df = pool_df
         self.idle_df = idle_df
-        self.total_maker_allocation = self.pool_df['Maker Allocation'].sum()
-        self.total_vault_size = idle_df['Maker Allocation'].iloc[0] + self.pool_df['Maker Allocation'].sum()
+        # Python numbers, as the notebook's object columns gave: a NumPy scalar here would make the
+        # row-wise reference round with np.round instead of round()
+        self.total_maker_allocation = python_number(self.pool_df['Maker Allocation'].sum())
+        self.total_vault_size = python_number(idle_df['Maker Allocation'].iloc[0]) + self.total_maker_allocation
+        self.realloc_metaparm = realloc_metaparm
         self.inactive_min_balance = realloc_metaparm['inactive_pool']['min_balance']
         self.inactive_max_utilization = realloc_metaparm['inactive_pool']['max_utilization']
         self.inactive_max_portion_to_withdraw = realloc_metaparm['inactive_pool']['max_portion_to_withdraw']
@@ -55,6 +180,7 @@ class PoolAnalysis:
         self.active_max_portion_to_withdraw = realloc_metaparm['active_pool']['max_portion_to_withdraw']
         self.active_allocation_significance_threshold = realloc_metaparm['active_pool']['allocation_significance_threshold']
         self.yes_funds = True
+        self.metrics = metrics or Metrics()
 
     # In a case we want to manually input values for a pool
     def input_values_for_pool(self, pool_df, pool_key):
@@ -83,7 +209,8 @@ class PoolAnalysis:
                     else:
                         value = float(value_input)
                         if value >= 0:
-                            pool_df.loc[pool_key, column] = value
+                            # Whole units, as populate_dataframe keeps them; the int64 columns reject fractions
+                            pool_df.loc[pool_key, column] = round(value)
                             break
                         else:
                             print("Error: The value must be a non-negative number.")
@@ -108,19 +235,13 @@ class PoolAnalysis:
         return int(row['Total Borrow'] * (row['Maker Allocation'] / row['Total Supply']))
 
     def calculate_optimal_rate(self, row):
-        if row['Utilization'] > 0.9:
-            return round(row['Borrow Rate'] / (30 * row['Utilization'] - 26), 4)
-        else:
-            return round(row['Borrow Rate'] / (0.25 + (5/6) * row['Utilization']), 4)
+        return round(float(irm.rate_at_target(row['Borrow Rate'], row['Utilization'])), 4)
         
     def calculate_capped_borrow_rate(self, row):
         return round(min(row['Borrow Rate'], row['Optimal Rate']), 4)
     
     def calculate_utilization_where_rate_equal_to_ssr(self, row):
-        if row['Optimal Rate'] < row['SSR']:
-            result = ((row['SSR'] / row['Optimal Rate']) + 26) / 30
-        else:
-            result = 1.2 * ((row['SSR'] / row['Optimal Rate']) - 0.25)
+        result = float(irm.utilization_at_rate(row['SSR'], row['Optimal Rate']))
         return round(min(result, 1), 4)
     
     def calculate_ssr_adjustment(self, row, min_balance):
@@ -154,10 +275,7 @@ class PoolAnalysis:
             return 0
         
     def calculate_utilization_where_rate_equal_to_min_target(self, row):
-        if row['Optimal Rate'] < row['Min Borrow Rate']:
-            result = ((row['Min Borrow Rate'] / row['Optimal Rate']) + 26) / 30
-        else:
-            result = 1.2 * ((row['Min Borrow Rate'] / row['Optimal Rate']) - 0.25)
+        result = float(irm.utilization_at_rate(row['Min Borrow Rate'], row['Optimal Rate']))
         return round(min(result, 1), 4)
     
     def calculate_active_withdrawals(self, row, yes_active_funds, min_balance, max_utilization, withdrawal_portion):
@@ -173,10 +291,7 @@ class PoolAnalysis:
             return 0
         
     def calculate_utilization_where_rate_equal_to_max_target(self, row):
-        if row['Optimal Rate'] < row['Max Borrow Rate']:
-            result = ((row['Max Borrow Rate'] / row['Optimal Rate']) + 26) / 30
-        else:
-            result = 1.2 * ((row['Max Borrow Rate'] / row['Optimal Rate']) - 0.25)
+        result = float(irm.utilization_at_rate(row['Max Borrow Rate'], row['Optimal Rate']))
         return round(min(result, 1), 4)
     
     def calculate_active_deposits(self, row):
@@ -211,10 +326,7 @@ class PoolAnalysis:
         return round(row['Total Borrow'] / row['Final Supply'], 4)
 
     def calculate_final_borrow_rate(self, row):
-        if row['Final Utilization'] < 0.9:
-            return round(0.25 * row['Optimal Rate'] + (5/6) * row['Final Utilization'] * row['Optimal Rate'], 4)
-        else:
-            return round(30 * row['Optimal Rate'] * row['Final Utilization'] - 26 * row['Optimal Rate'], 4)
+        return round(float(irm.borrow_rate(row['Optimal Rate'], row['Final Utilization'])), 4)
         
     def calculate_final_capped_rate(self, row):
         return min(row['Final Borrow Rate'], row['Optimal Rate'])
@@ -244,6 +356,20 @@ class PoolAnalysis:
         print("\nUpdated DataFrame with Status:")
 
     def update_pool_dataframe(self):
+        # Columnar engine: the same chain of calculate_* columns for all pools at once
+        start = time.perf_counter()
+        columns = {name: self.pool_df[name].to_numpy(dtype=float) for name in INPUT_COLUMNS}
+        status = self.pool_df['Status'].to_numpy()
+        results = compute_pool_columns(columns, status == 'Active', status == 'Inactive',
+                                       self.total_vault_size, self.realloc_metaparm, self.yes_funds)
+        for column, values in results.items():
+            self.pool_df[column] = values
+
+        self.metrics.stage('analysis', time.perf_counter() - start, len(self.pool_df))
+        return self.pool_df
+
+    def update_pool_dataframe_rowwise(self):
+        # Reference implementation with the per-row calculate_* methods, kept for parity checks
         for index, row in self.pool_df.iterrows():
             row['Total Borrow'] = self.calculate_total_borrow(row)
             row['Maker Borrow'] = self.calculate_maker_borrow(row)
@@ -299,10 +425,13 @@ class PoolAnalysis:
 
 # Class for getting statistics of the pools
 class PoolOverview:
-    def __init__(self, pool_df, pool_overview):
+    def __init__(self, pool_df, pool_overview, metrics=None):
         self.pool_df = pool_df
         self.pool_overview = pool_overview
+        self.metrics = metrics or Metrics()
 
+    # Per-metric reference implementations, kept for parity checks; update_pool_overview computes
+    # every metric in one pass
     def update_total_non_idle_allocation(self, pool_df, pool_overview):
         total_non_idle_allocation = pool_df['Maker Allocation'].sum()
         future_total_non_idle_allocation = pool_df['Final Allocation'].sum()
@@ -360,11 +489,23 @@ class PoolOverview:
         return pool_overview
 
     def compute_change(self, pool_overview):
-        pool_overview['Change'] = pool_overview.apply(
-            lambda row: (row['Future'] - row['Current']) / row['Current'] if row['Current'] != 0 else None, axis=1)
+        pool_overview['Change'] = compute_change(pool_overview['Current'], pool_overview['Future'])
         return pool_overview
-    
+
     def update_pool_overview(self):
+        # One reduction of the OVERVIEW_TERMS products gives every Current and Future value
+        start = time.perf_counter()
+        sums = dict(zip(OVERVIEW_TERMS, overview_term_matrix(overview_columns(self.pool_df)).sum(axis=-1)))
+        table = overview_table(sums)
+        for i, column in enumerate(OVERVIEW_COLUMNS):
+            self.pool_overview[column] = pd.Series(table[:, i], index=OVERVIEW_METRICS)
+        pool_overview = self.pool_overview
+
+        self.metrics.stage('overview', time.perf_counter() - start, len(self.pool_df))
+        return pool_overview
+
+    def update_pool_overview_per_metric(self):
+        # Reference implementation with one method per metric, kept for parity checks
         pool_overview = self.update_total_non_idle_allocation(self.pool_df, self.pool_overview)
         pool_overview = self.update_supply_weighted_lltv(self.pool_df, self.pool_overview)
         pool_overview = self.update_supply_weighted_sUSDe(self.pool_df, self.pool_overview)
@@ -372,5 +513,37 @@ class PoolOverview:
         pool_overview = self.update_avg_capped_rate(self.pool_df, self.pool_overview)
         pool_overview = self.update_rate_at_prior_equilibrium(self.pool_df, self.pool_overview)
         pool_overview = self.compute_change(self.pool_overview)
-        
-        return pool_overview
\ No newline at end of file
+        return pool_overview
+
+    @staticmethod
+    def stack(pool_frames, names=('Snapshot', 'Metric')):
+        """Overview tables of many pool frames (snapshots or scenarios) in one pass.
+
+        `pool_frames` is a dict or list of analysed pool frames, or one frame indexed by (snapshot, pool)
+        such as MultiVaultRunner.run() returns; the latter is read once, with no per-snapshot pandas work.
+        The result is indexed by (snapshot, metric) and backed by a single float64 array.
+        """
+        if isinstance(pool_frames, pd.DataFrame):
+            codes, snapshots = pd.factorize(pool_frames.index.get_level_values(0))
+            terms = overview_term_matrix(overview_columns(pool_frames))
+            if len(codes) and (np.diff(codes) < 0).any():
+                order = np.argsort(codes, kind='stable')
+                terms = terms[:, order]
+            counts = np.bincount(codes, minlength=len(snapshots))
+        else:
+            if not isinstance(pool_frames, dict):
+                pool_frames = dict(enumerate(pool_frames))
+            snapshots = pd.Index(list(pool_frames))
+            blocks = [overview_columns(pool_df) for pool_df in pool_frames.values()]
+            counts = np.array([len(block['sUSDe']) for block in blocks])
+            columns = {name: np.concatenate([block[name] for block in blocks]) for name in blocks[0]}
+            terms = overview_term_matrix(columns)
+        if len(counts) and (counts == counts[0]).all():
+            # Same number of pools in every snapshot: a plain reduction over the pool axis
+            sums = terms.reshape(len(terms), len(snapshots), -1).sum(axis=-1)
+        else:
+            sums = np.add.reduceat(terms, np.concatenate([[0], np.cumsum(counts)[:-1]]), axis=1)
+
+        table = overview_table(dict(zip(OVERVIEW_TERMS, sums)))
+        index = pd.MultiIndex.from_product([snapshots, OVERVIEW_METRICS], names=list(names))
+        return pd.DataFrame(table.reshape(-1, len(OVERVIEW_COLUMNS)), index=index, columns=OVERVIEW_COLUMNS)
\ No newline at end of file
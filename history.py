@@ -0,0 +1,218 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import requests
+
+from data_manipulation import POOL_SCHEMA, parse_lltv
+from pool_engine import INPUT_COLUMNS, OVERVIEW_METRICS, compute_overview, compute_pool_columns, round_half_even
+
+# Fields stored per pool and day, named after the ApiBA.fetch_data records
+HISTORY_FIELDS = ['total_supply', 'utilization', 'borrow_rate', 'maker_allocation', 'supply_cap', 'ssr_rate']
+
+
+# Daily market history as one memory-mapped float64 array of shape (pools, days, fields).
+# Missing values are NaN; day 0 is the oldest day.
+class HistoryStore:
+    def __init__(self, directory, mode='r'):
+        self.directory = directory
+        with open(os.path.join(directory, 'history.json')) as file:
+            meta = json.load(file)
+        self.markets = meta['markets']
+        self.pools = meta['pools']
+        self.dates = [date.fromisoformat(day) for day in meta['dates']]
+        self.fields = meta['fields']
+        self.data = np.load(os.path.join(directory, 'history.npy'), mmap_mode=mode)
+
+    @classmethod
+    def create(cls, directory, market_to_pool, end_date, n_days, overwrite=False):
+        # Refuses to replace an existing history unless asked to
+        paths = [os.path.join(directory, name) for name in ['history.json', 'history.npy']]
+        if not overwrite and any(os.path.exists(path) for path in paths):
+            raise FileExistsError(f"A history already exists in {directory}; pass overwrite=True to replace it")
+        os.makedirs(directory, exist_ok=True)
+        dates = [end_date - timedelta(days=n_days - 1 - day) for day in range(n_days)]
+        meta = {
+            'markets': list(market_to_pool),
+            'pools': list(market_to_pool.values()),
+            'dates': [day.isoformat() for day in dates],
+            'fields': HISTORY_FIELDS,
+        }
+        with open(os.path.join(directory, 'history.json'), 'w') as file:
+            json.dump(meta, file)
+        data = np.lib.format.open_memmap(os.path.join(directory, 'history.npy'), mode='w+',
+                                         dtype=np.float64, shape=(len(market_to_pool), n_days, len(HISTORY_FIELDS)))
+        data[:] = np.nan
+        data.flush()
+        del data
+        return cls(directory, mode='r+')
+
+    def field(self, name):
+        # (pools, days) view of one field
+        return self.data[:, :, self.fields.index(name)]
+
+    def day(self, index):
+        # (pools, fields) view of one day
+        return self.data[:, index, :]
+
+
+def to_float(value):
+    # A fetched value as populate_dataframe reads it: a missing or null field of a fetched page is 0.
+    # Cells of pages that failed are never written and stay NaN.
+    return float(value or 0.0)
+
+
+def backfill(api, market_to_pool, directory, n_days, end_date=None, ssr_rates=None, overwrite=False):
+    """Fetch `n_days` of daily history for every market into a new HistoryStore.
+
+    Market and vault-pool pages are fetched with days_ago set for every day, on the ApiBA
+    session and thread pool, without going into its response log or cache. The SSR endpoint has
+    no history, so every day gets the current rate unless `ssr_rates` maps days_ago to the rate
+    of that day. Cells whose page failed stay NaN.
+    """
+    end_date = end_date or date.today()
+    store = HistoryStore.create(directory, market_to_pool, end_date, n_days, overwrite)
+    markets = store.markets
+    field = {name: i for i, name in enumerate(store.fields)}
+
+    def fetch_market_day(task):
+        # One failed page leaves its cell NaN instead of aborting the backfill
+        pool, days_ago = task
+        url = api.historic_url(api.base_market_url.format(markets[pool]), days_ago)
+        try:
+            payload = api.get_json('market', url, record=False)
+        except requests.RequestException:
+            payload = None
+        if not payload:
+            api.metrics.event('history_fetch_failed', endpoint='market', market=markets[pool], days_ago=days_ago)
+            return None
+        return payload[0]
+
+    def fetch_vault_day(days_ago):
+        # (supply, cap) per market of the store, or None when a page failed; only these two fields are kept
+        positions = api.fetch_vault_positions(api.historic_url(api.vaults_url, days_ago), record=False)
+        if positions is None:
+            api.metrics.event('history_fetch_failed', endpoint='vault', days_ago=days_ago)
+            return None
+        return {market: (positions[market].get('supply'), positions[market].get('cap'))
+                for market in markets if market in positions}
+
+    tasks = [(pool, days_ago) for pool in range(len(markets)) for days_ago in range(n_days)]
+    with ThreadPoolExecutor(max_workers=api.max_workers) as executor:
+        vault_days = list(executor.map(fetch_vault_day, range(n_days)))
+        market_days = executor.map(fetch_market_day, tasks)
+        try:
+            current_ssr = api.fetch_ssr_rate(record=False)
+        except requests.RequestException:
+            current_ssr = None
+        if current_ssr is None:
+            api.metrics.event('history_fetch_failed', endpoint='ssr')
+
+        for (pool, days_ago), market_data in zip(tasks, market_days):
+            day = n_days - 1 - days_ago
+            # A failed positions pull, or a market missing from it, leaves supply and cap NaN rather than 0
+            vault_item = (vault_days[days_ago] or {}).get(markets[pool])
+            ssr_rate = (ssr_rates or {}).get(days_ago, current_ssr)
+            row = store.data[pool, day]
+            if market_data is not None:
+                row[field['total_supply']] = to_float(market_data['total_supply'])
+                row[field['utilization']] = to_float(market_data['utilization'])
+                row[field['borrow_rate']] = to_float(market_data['borrow_rate_apy'])
+            if vault_item is not None:
+                row[field['maker_allocation']] = to_float(vault_item[0])
+                row[field['supply_cap']] = to_float(vault_item[1])
+            if ssr_rate is not None:
+                row[field['ssr_rate']] = to_float(ssr_rate)
+
+    store.data.flush()
+    return store
+
+
+# Replays the PoolAnalysis rules day by day over a HistoryStore.
+# Every day is analysed on that day's observed state, the way the notebook would have run it then.
+class Backtest:
+    def __init__(self, store, statuses, parameters, realloc_metaparm, idle_pool='Idle'):
+        self.store = store
+        self.statuses = statuses
+        self.parameters = parameters
+        self.realloc_metaparm = realloc_metaparm
+        self.idle_pool = idle_pool
+
+    def day_columns(self, day):
+        # The day's fields with the rounding of PoolDataHandler.populate_dataframe; cells never fetched stay NaN
+        values = np.asarray(self.store.day(day), dtype=np.float64)
+        field = {name: values[:, i] for i, name in enumerate(self.store.fields)}
+        return {column: round_half_even(field[key], decimals) for column, key, _, decimals in POOL_SCHEMA}
+
+    def run(self):
+        """Per-day allocation and earnings of the rules next to what the vault actually held.
+
+        Returns (summary, allocations): the summary has one row per date, and allocations holds
+        the Final Allocation of every pool per date. Pools without supply on a day are skipped.
+        A day with any field of a pool, or the idle allocation, missing from the store is not
+        analysed: its row has Complete False and NaN everywhere else, so a partial vault is never
+        taken for the whole vault, and the cumulative interest leaves it out.
+        """
+        pools = self.store.pools
+        pool_index = [i for i, pool in enumerate(pools) if pool != self.idle_pool]
+        idle_index = [i for i, pool in enumerate(pools) if pool == self.idle_pool]
+        names = np.array(pools)[pool_index]
+        status = np.array([self.statuses.get(pool) for pool in names])
+        lltv = np.array([parse_lltv(pool) for pool in names])
+        is_susde = np.char.startswith(names.astype(str), 'sUSDe')
+
+        parameters = dict(self.parameters)
+        parameters['Fixed Slope'] = parameters['Fixed Slope per 100M'] / 100000000
+        parameters['Proportional Slope'] = parameters['Proportional Slope per 100M'] / 100000000
+
+        allocations = np.full((len(self.store.dates), len(names)), np.nan)
+        rows = []
+        for day, day_date in enumerate(self.store.dates):
+            columns = self.day_columns(day)
+            idle_allocation = columns['Maker Allocation'][idle_index]
+            columns = {name: values[pool_index] for name, values in columns.items()}
+            if np.isnan(idle_allocation).any() or any(np.isnan(values).any() for values in columns.values()):
+                rows.append({'Date': day_date, 'Complete': False})
+                continue
+            idle_allocation = idle_allocation.sum()
+            present = columns['Total Supply'] > 0
+            if not present.any():
+                continue
+            columns = {name: values[present] for name, values in columns.items()}
+            for name in INPUT_COLUMNS:
+                if name not in columns:
+                    columns[name] = np.full(present.sum(), parameters[name], dtype=np.float64)
+            total_vault_size = idle_allocation + columns['Maker Allocation'].sum()
+
+            results = compute_pool_columns(columns, status[present] == 'Active', status[present] == 'Inactive',
+                                           total_vault_size, self.realloc_metaparm)
+            allocations[day, present] = results['Final Allocation']
+            results.update({name: columns[name] for name in ['Maker Allocation', 'Borrow Rate']})
+            overview = compute_overview(results, lltv[present], is_susde[present])
+
+            actual_borrow = results['Maker Borrow']
+            rule_borrow = results['Final Allocation'] * results['Final Utilization']
+            row = {
+                'Date': day_date,
+                'Complete': True,
+                'Total Vault Size': total_vault_size,
+                'Actual Allocation': columns['Maker Allocation'].sum(),
+                'Rule Allocation': results['Final Allocation'].sum(),
+                'Actual Daily Interest': (actual_borrow * columns['Borrow Rate']).sum() / 365,
+                'Rule Daily Interest': (rule_borrow * results['Final Borrow Rate']).sum() / 365,
+            }
+            for metric in OVERVIEW_METRICS:
+                row[f'{metric} Current'], row[f'{metric} Future'] = overview[metric]
+            rows.append(row)
+
+        columns = ['Date', 'Complete', 'Total Vault Size', 'Actual Allocation', 'Rule Allocation',
+                   'Actual Daily Interest', 'Rule Daily Interest']
+        columns += [f'{metric} {when}' for metric in OVERVIEW_METRICS for when in ['Current', 'Future']]
+        summary = pd.DataFrame(rows, columns=columns).set_index('Date')
+        summary['Actual Cumulative Interest'] = summary['Actual Daily Interest'].cumsum()
+        summary['Rule Cumulative Interest'] = summary['Rule Daily Interest'].cumsum()
+        allocations = pd.DataFrame(allocations, index=self.store.dates, columns=names)
+        return summary, allocations
@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+
+from pool_engine import (COLUMN_FORMULAS, INPUT_COLUMNS, OUTPUT_COLUMNS, OVERVIEW_COLUMNS, OVERVIEW_METRICS,
+                         OVERVIEW_TERMS, compute_pool_columns, overview_table, overview_terms)
+
+
+# Keeps the PoolAnalysis columns and PoolOverview aggregates of a continuously running monitor up to date.
+# Input changes mark (column, pools) dirty; recompute() walks COLUMN_FORMULAS in order and re-evaluates a
+# column only for the pools whose inputs changed, and only passes on the pools whose value really changed.
+class IncrementalPoolAnalysis:
+    def __init__(self, pool_df, idle_df, realloc_metaparm, yes_funds=True, resync_every=10000):
+        self.pools = list(pool_df.index)
+        self.position = {pool: i for i, pool in enumerate(self.pools)}
+        self.values = {name: pool_df[name].to_numpy(dtype=float).copy() for name in INPUT_COLUMNS}
+        status = pool_df['Status'].to_numpy()
+        self.values['Active'] = status == 'Active'
+        self.values['Inactive'] = status == 'Inactive'
+        self.values['LLTV'] = pool_df['LLTV'].to_numpy(dtype=float).copy()
+        self.values['sUSDe'] = pool_df.index.str.startswith('sUSDe').astype(float)
+        self.idle_allocation = float(idle_df['Maker Allocation'].iloc[0])
+        self.total_vault_size = self.idle_allocation + self.values['Maker Allocation'].sum()
+        self.realloc_metaparm = realloc_metaparm
+        self.yes_funds = yes_funds
+        self.resync_every = resync_every
+        self.updates = 0
+
+        self.dirty = {}
+        self.recompute_all()
+
+    def ctx(self):
+        return {'total_vault_size': self.total_vault_size, 'realloc_metaparm': self.realloc_metaparm,
+                'yes_funds': self.yes_funds}
+
+    def mark(self, column, rows):
+        self.dirty.setdefault(column, set()).update(rows)
+
+    def recompute_all(self):
+        columns = {name: self.values[name] for name in INPUT_COLUMNS}
+        results = compute_pool_columns(columns, self.values['Active'], self.values['Inactive'],
+                                       self.total_vault_size, self.realloc_metaparm, self.yes_funds)
+        for column, values in results.items():
+            self.values[column] = np.array(values)
+        self.resync()
+        self.dirty = {}
+
+    def resync(self):
+        # Rebuild the aggregate totals from scratch, dropping any drift of the running updates
+        self.terms = {term: values.copy() for term, values in overview_terms(self.values).items()}
+        self.sums = {term: values.sum() for term, values in self.terms.items()}
+
+    def update_pool(self, pool_key, changes):
+        # New input values for one pool, e.g. {'Utilization': 0.91, 'Borrow Rate': 0.12}
+        row = self.position[pool_key]
+        for column, value in changes.items():
+            if column == 'Status':
+                self.values['Active'][row] = value == 'Active'
+                self.values['Inactive'][row] = value == 'Inactive'
+                self.mark('Active', [row])
+                self.mark('Inactive', [row])
+                continue
+            if column not in INPUT_COLUMNS:
+                raise KeyError(f"{column} is not an input column")
+            if column == 'Maker Allocation':
+                self.total_vault_size += value - self.values[column][row]
+                self.mark('Total Vault Size', range(len(self.pools)))
+            self.values[column][row] = value
+            self.mark(column, [row])
+
+    def update_column(self, column, value):
+        # The same new value for every pool, e.g. a new SSR
+        for pool_key in self.pools:
+            self.update_pool(pool_key, {column: value})
+
+    def update_idle_allocation(self, value):
+        self.total_vault_size += value - self.idle_allocation
+        self.idle_allocation = value
+        self.mark('Total Vault Size', range(len(self.pools)))
+
+    def update_realloc_metaparm(self, realloc_metaparm):
+        self.realloc_metaparm = realloc_metaparm
+        self.mark('Realloc Metaparm', range(len(self.pools)))
+
+    def recompute(self):
+        """Bring every dirty column and aggregate up to date; returns {column: pools that changed}."""
+        ctx = self.ctx()
+        changed = {}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for column, dependencies, formula in COLUMN_FORMULAS:
+                rows = set()
+                for dependency in dependencies:
+                    rows |= self.dirty.get(dependency, set())
+                if not rows:
+                    continue
+                index = np.fromiter(sorted(rows), dtype=np.intp, count=len(rows))
+                subset = {name: self.values[name][index] for name in dependencies if name in self.values}
+                new = formula(subset, ctx)
+                old = self.values[column][index]
+                differs = ~((new == old) | (np.isnan(new) & np.isnan(old)))
+                self.values[column][index] = new
+                if differs.any():
+                    changed_rows = index[differs]
+                    self.mark(column, changed_rows)
+                    changed[column] = [self.pools[row] for row in changed_rows]
+
+            for term, factors in OVERVIEW_TERMS.items():
+                rows = set()
+                for factor in factors:
+                    rows |= self.dirty.get(factor, set())
+                if not rows:
+                    continue
+                index = np.fromiter(sorted(rows), dtype=np.intp, count=len(rows))
+                new = np.ones(len(index))
+                for factor in factors:
+                    new = new * self.values[factor][index]
+                self.sums[term] += (new - self.terms[term][index]).sum()
+                self.terms[term][index] = new
+
+        self.dirty = {}
+        self.updates += 1
+        if self.updates % self.resync_every == 0:
+            self.resync()
+        return changed
+
+    def pool_frame(self):
+        # Current state as a PoolAnalysis-style frame
+        status = np.where(self.values['Active'], 'Active', np.where(self.values['Inactive'], 'Inactive', None))
+        frame = pd.DataFrame({'Status': status, 'LLTV': self.values['LLTV']}, index=self.pools)
+        for column in INPUT_COLUMNS + OUTPUT_COLUMNS:
+            frame[column] = self.values[column]
+        return frame
+
+    def overview(self):
+        # Current state as a PoolOverview-style table
+        return pd.DataFrame(overview_table(self.sums), index=OVERVIEW_METRICS, columns=OVERVIEW_COLUMNS)
@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+
+# Morpho AdaptiveCurveIRM constants: curve steepness 4 around a 90% target utilization, and a
+# rate at target that adapts at up to 50x per year, bounded to 0.1%-200%
+TARGET_UTILIZATION = 0.9
+CURVE_STEEPNESS = 4
+ADJUSTMENT_SPEED = 50.0
+MIN_RATE_AT_TARGET = 0.001
+MAX_RATE_AT_TARGET = 2.0
+SECONDS_PER_YEAR = 365 * 24 * 3600
+SECONDS_PER_DAY = 24 * 3600
+
+# The curve in the notebook's form: rate_at_target * (0.25 + 5/6 * u) below the target and
+# rate_at_target * (30 * u - 26) above it, i.e. 1 / steepness at u = 0 and steepness at u = 1.
+# The coefficients are written out rather than derived, so every rate keeps the notebook's float math.
+LOWER_INTERCEPT = 0.25
+LOWER_SLOPE = 5/6
+UPPER_SLOPE = 30
+UPPER_INTERCEPT = 26
+# 1 / LOWER_SLOPE, as the notebook's inverse multiplies by it
+LOWER_SLOPE_INVERSE = 1.2
+
+
+def borrow_rate(rate_at_target, utilization):
+    """Borrow rate of the curve at `utilization`; arrays broadcast against each other."""
+    return np.where(
+        utilization < TARGET_UTILIZATION,
+        LOWER_INTERCEPT * rate_at_target + LOWER_SLOPE * utilization * rate_at_target,
+        UPPER_SLOPE * rate_at_target * utilization - UPPER_INTERCEPT * rate_at_target)
+
+
+def rate_at_target(rate, utilization):
+    # Inverse in the rate at target: the curve that gives `rate` at `utilization` (the Optimal Rate)
+    return np.where(
+        utilization > TARGET_UTILIZATION,
+        rate / (UPPER_SLOPE * utilization - UPPER_INTERCEPT),
+        rate / (LOWER_INTERCEPT + LOWER_SLOPE * utilization))
+
+
+def utilization_at_rate(rate, rate_at_target):
+    # Inverse in the utilization: where the curve reaches `rate`; above 1 when it never does
+    ratio = rate / rate_at_target
+    return np.where(rate_at_target < rate, (ratio + UPPER_INTERCEPT) / UPPER_SLOPE,
+                    LOWER_SLOPE_INVERSE * (ratio - LOWER_INTERCEPT))
+
+
+def utilization_error(utilization):
+    # Distance from the target, normalised to -1 at 0% and +1 at 100% utilization
+    utilization = np.clip(np.asarray(utilization, dtype=np.float64), 0, 1)
+    return np.where(utilization > TARGET_UTILIZATION,
+                    (utilization - TARGET_UTILIZATION) / (1 - TARGET_UTILIZATION),
+                    (utilization - TARGET_UTILIZATION) / TARGET_UTILIZATION)
+
+
+def adapt_rate_at_target(start, utilization, seconds):
+    """Rate at target after `seconds` at a constant `utilization`, and its average over that time.
+
+    The rate at target moves exponentially at ADJUSTMENT_SPEED times the utilization error per year,
+    and the average is the trapezoidal one the contract uses for the interest of the period.
+    """
+    linear_adaptation = ADJUSTMENT_SPEED / SECONDS_PER_YEAR * utilization_error(utilization) * seconds
+    end = np.clip(start * np.exp(linear_adaptation), MIN_RATE_AT_TARGET, MAX_RATE_AT_TARGET)
+    middle = np.clip(start * np.exp(linear_adaptation / 2), MIN_RATE_AT_TARGET, MAX_RATE_AT_TARGET)
+    return end, (start + end + 2 * middle) / 4
+
+
+def simulate(start_rate_at_target, utilization, horizon_days, steps, elasticity=0.0):
+    """Step the rate at target of every pool (last axis) forward over `horizon_days`.
+
+    With `elasticity` 0 the utilization stays where the reallocation left it and every step is
+    computed at once. Otherwise borrowers react to the rate: after each step the borrow scales by
+    (new rate / old rate) ** -elasticity, which moves the utilization the next step sees.
+    Returns {'Time', 'Rate at Target', 'Borrow Rate', 'Utilization'} with steps + 1 rows;
+    'Borrow Rate' is the average rate over the step ending at that row.
+    """
+    start_rate_at_target = np.asarray(start_rate_at_target, dtype=np.float64)
+    utilization = np.broadcast_to(np.asarray(utilization, dtype=np.float64), start_rate_at_target.shape)
+    step_seconds = horizon_days * SECONDS_PER_DAY / steps
+    times = np.arange(steps + 1) * step_seconds
+    steps_axis = (slice(None),) + (None,) * start_rate_at_target.ndim
+
+    if not elasticity:
+        # Constant utilization: the path has a closed form, and clipping it equals clipping every step
+        end = adapt_rate_at_target(start_rate_at_target, utilization, times[steps_axis])[0]
+        average = adapt_rate_at_target(end[:-1], utilization, step_seconds)[1]
+        rates = np.concatenate([borrow_rate(start_rate_at_target, utilization)[None],
+                                borrow_rate(average, utilization)])
+        return {'Time': times, 'Rate at Target': end, 'Borrow Rate': rates,
+                'Utilization': np.broadcast_to(utilization, end.shape).copy()}
+
+    rate_path = np.empty((steps + 1,) + start_rate_at_target.shape)
+    borrow_path = np.empty_like(rate_path)
+    utilization_path = np.empty_like(rate_path)
+    current = start_rate_at_target
+    current_utilization = utilization
+    rate_path[0] = current
+    borrow_path[0] = borrow_rate(current, current_utilization)
+    utilization_path[0] = current_utilization
+    for step in range(1, steps + 1):
+        current, average = adapt_rate_at_target(current, current_utilization, step_seconds)
+        rate = borrow_rate(average, current_utilization)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            demand = np.where(borrow_path[step - 1] > 0, (rate / borrow_path[step - 1]) ** -elasticity, 1.0)
+        current_utilization = np.clip(current_utilization * demand, 0, 1)
+        rate_path[step] = current
+        borrow_path[step] = rate
+        utilization_path[step] = current_utilization
+    return {'Time': times, 'Rate at Target': rate_path, 'Borrow Rate': borrow_path, 'Utilization': utilization_path}
+
+
+def simulate_plan(pool_df, horizon_days=7, steps=168, elasticity=0.0):
+    """How the borrow rates of an analysed pool frame drift once its Final Utilization is in place.
+
+    Starts every pool at its Optimal Rate (the rate at target implied by today's rate) and reports
+    where its rate ends up after `horizon_days`, next to the Min/Max Borrow Rate band the plan aims for.
+    """
+    path = simulate(pool_df['Optimal Rate'].to_numpy(dtype=np.float64),
+                    pool_df['Final Utilization'].to_numpy(dtype=np.float64), horizon_days, steps, elasticity)
+    end_rate = path['Borrow Rate'][-1]
+    report = pd.DataFrame({
+        'Final Borrow Rate': pool_df['Final Borrow Rate'].to_numpy(dtype=np.float64),
+        'Simulated Rate at Target': path['Rate at Target'][-1],
+        'Simulated Borrow Rate': end_rate,
+        'Average Simulated Borrow Rate': path['Borrow Rate'][1:].mean(axis=0),
+        'Simulated Utilization': path['Utilization'][-1],
+        'Min Borrow Rate': pool_df['Min Borrow Rate'].to_numpy(dtype=np.float64),
+        'Max Borrow Rate': pool_df['Max Borrow Rate'].to_numpy(dtype=np.float64),
+    }, index=pool_df.index)
+    report['Within Target'] = (end_rate >= report['Min Borrow Rate']) & (end_rate <= report['Max Borrow Rate'])
+    return report
@@ -0,0 +1,149 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Interface for metrics hooks; subclass it and override the calls you care about
+class MetricsHook:
+    def stage(self, stage, seconds, rows):
+        # A stage (fetch, populate, analysis, overview, ...) finished; rows is None when not counted
+        pass
+
+    def request(self, endpoint, status, seconds, size, retries):
+        # One HTTP call; status is the HTTP status code, or 'error' when the call raised
+        pass
+
+    def event(self, name, labels):
+        # A counted event, e.g. 'market_fetch_failed' with {'market': ...}
+        pass
+
+
+# Fans every measurement out to the registered hooks. With no hooks it only costs a clock read per stage.
+class Metrics:
+    def __init__(self, hooks=None):
+        self.hooks = list(hooks or [])
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+        return hook
+
+    @contextmanager
+    def timed(self, stage):
+        # with metrics.timed('populate') as record: ...; record['rows'] = len(frame)
+        record = {'rows': None}
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            self.stage(stage, time.perf_counter() - start, record['rows'])
+
+    def stage(self, stage, seconds, rows=None):
+        for hook in self.hooks:
+            hook.stage(stage, seconds, rows)
+
+    def request(self, endpoint, status, seconds, size=0, retries=0):
+        for hook in self.hooks:
+            hook.request(endpoint, status, seconds, size, retries)
+
+    def event(self, name, **labels):
+        for hook in self.hooks:
+            hook.event(name, labels)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{escape_label(value)}"' for key, value in labels) + '}'
+
+
+# Keeps running totals of every stage, endpoint and event, and exports them as JSON or Prometheus text
+class MetricsRecorder(MetricsHook):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+            self.requests = {}
+            self.events = {}
+
+    def stage(self, stage, seconds, rows):
+        with self.lock:
+            totals = self.stages.setdefault(stage, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                                                    'last_seconds': 0.0, 'rows': None})
+            totals['count'] += 1
+            totals['seconds'] += seconds
+            totals['max_seconds'] = max(totals['max_seconds'], seconds)
+            totals['last_seconds'] = seconds
+            if rows is not None:
+                totals['rows'] = rows
+
+    def request(self, endpoint, status, seconds, size, retries):
+        with self.lock:
+            totals = self.requests.setdefault((endpoint, str(status)), {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                                                                        'bytes': 0, 'retries': 0})
+            totals['count'] += 1
+            totals['seconds'] += seconds
+            totals['max_seconds'] = max(totals['max_seconds'], seconds)
+            totals['bytes'] += size
+            totals['retries'] += retries
+
+    def event(self, name, labels):
+        key = (name, tuple(sorted((key, str(value)) for key, value in labels.items())))
+        with self.lock:
+            self.events[key] = self.events.get(key, 0) + 1
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'stages': {stage: dict(totals) for stage, totals in self.stages.items()},
+                'requests': [dict(totals, endpoint=endpoint, status=status)
+                             for (endpoint, status), totals in self.requests.items()],
+                'events': [{'event': name, 'labels': dict(labels), 'count': count}
+                           for (name, labels), count in self.events.items()],
+            }
+
+    def to_json(self, indent=2):
+        return json.dumps(self.as_dict(), indent=indent)
+
+    def to_prometheus(self, prefix='morpho_realloc'):
+        """Prometheus text exposition format (version 0.0.4) of the running totals."""
+        snapshot = self.as_dict()
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            lines.append(f'# HELP {prefix}_{name} {help_text}')
+            lines.append(f'# TYPE {prefix}_{name} {kind}')
+            for labels, value in samples:
+                lines.append(f'{prefix}_{name}{format_labels(labels)} {value}')
+
+        stages = snapshot['stages']
+        family('stage_runs_total', 'counter', 'Completed runs of each stage.',
+               [([('stage', stage)], totals['count']) for stage, totals in stages.items()])
+        family('stage_seconds_total', 'counter', 'Wall time spent in each stage.',
+               [([('stage', stage)], repr(totals['seconds'])) for stage, totals in stages.items()])
+        family('stage_last_seconds', 'gauge', 'Wall time of the latest run of each stage.',
+               [([('stage', stage)], repr(totals['last_seconds'])) for stage, totals in stages.items()])
+        family('stage_rows', 'gauge', 'Rows handled by the latest run of each stage.',
+               [([('stage', stage)], totals['rows']) for stage, totals in stages.items()
+                if totals['rows'] is not None])
+
+        requests = snapshot['requests']
+        family('http_requests_total', 'counter', 'HTTP calls per endpoint and status code.',
+               [([('endpoint', r['endpoint']), ('status', r['status'])], r['count']) for r in requests])
+        family('http_request_seconds_total', 'counter', 'Wall time of HTTP calls per endpoint and status code.',
+               [([('endpoint', r['endpoint']), ('status', r['status'])], repr(r['seconds'])) for r in requests])
+        family('http_response_bytes_total', 'counter', 'Response payload bytes per endpoint and status code.',
+               [([('endpoint', r['endpoint']), ('status', r['status'])], r['bytes']) for r in requests])
+        family('http_retries_total', 'counter', 'Retries made before the final response.',
+               [([('endpoint', r['endpoint']), ('status', r['status'])], r['retries']) for r in requests])
+
+        family('events_total', 'counter', 'Counted events such as failed market fetches.',
+               [([('event', e['event'])] + sorted(e['labels'].items()), e['count']) for e in snapshot['events']])
+        return '\n'.join(lines) + '\n'
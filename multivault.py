@@ -0,0 +1,97 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pandas as pd
+
+from api import ApiBA
+from cache import ResponseCache
+from metrics import Metrics
+from data_manipulation import (IDLE_COLUMNS, POOL_COLUMNS, PoolAnalysis, PoolDataHandler, PoolOverview,
+                               set_statuses, set_vault_parameters)
+from pool_engine import OVERVIEW_METRICS
+
+
+def analyse_vault(vault, data, idle_data):
+    """The notebook's analysis for one vault: populate, analyse and summarise its pools.
+
+    Runs in a worker process, so it only takes and returns picklable values.
+    """
+    market_to_pool = vault['market_to_pool']
+    idle_market_to_pool = vault['idle_market_to_pool']
+    pools_df = pd.DataFrame(index=list(market_to_pool.values()), columns=POOL_COLUMNS)
+    idle_df = pd.DataFrame(index=list(idle_market_to_pool.values()), columns=IDLE_COLUMNS)
+
+    pools_df = PoolDataHandler(pools_df, market_to_pool).populate_dataframe(data)
+    idle_df = PoolDataHandler(idle_df, idle_market_to_pool).populate_dataframe(idle_data)
+    set_statuses(pools_df, vault['statuses'])
+    set_vault_parameters(pools_df, vault['parameters'])
+
+    pool_df = PoolAnalysis(pools_df, idle_df, vault['realloc_metaparm']).update_pool_dataframe()
+    pool_overview = pd.DataFrame(index=OVERVIEW_METRICS, columns=['Current', 'Future', 'Change'])
+    pool_overview = PoolOverview(pool_df, pool_overview).update_pool_overview()
+    return pool_df, idle_df, pool_overview
+
+
+# Runs the analysis for several MetaMorpho vaults at once.
+# Each vault is a dict with 'name', 'target_wallet', 'vaults_url', 'market_to_pool', 'idle_market_to_pool',
+# 'statuses', 'parameters' and 'realloc_metaparm'. Markets shared by vaults are fetched once, and the
+# per-vault analysis runs in worker processes.
+class MultiVaultRunner:
+    def __init__(self, base_market_url, base_wallet_url, ssr_url, vaults, max_workers=None, fetch_workers=8,
+                 metrics=None):
+        self.base_market_url = base_market_url
+        self.base_wallet_url = base_wallet_url
+        self.ssr_url = ssr_url
+        self.vaults = vaults
+        self.max_workers = max_workers
+        self.fetch_workers = fetch_workers
+        # One session and cache for every vault, so a market page fetched for one vault serves them all
+        self.cache = ResponseCache()
+        self.session = ApiBA.build_session(fetch_workers, 3, 0.5)
+        # Fetches report to the hooks here; the worker processes only report the analysis stage as a whole
+        self.metrics = metrics or Metrics()
+
+    def markets(self):
+        # Union of every vault's markets, idle markets included, in first-seen order
+        markets = {}
+        for vault in self.vaults:
+            markets.update(dict.fromkeys(vault['market_to_pool']))
+            markets.update(dict.fromkeys(vault['idle_market_to_pool']))
+        return list(markets)
+
+    def api(self, markets, target_wallet=None, vaults_url=None):
+        return ApiBA(self.base_market_url, self.base_wallet_url, markets, target_wallet, vaults_url, self.ssr_url,
+                     max_workers=self.fetch_workers, cache=self.cache, metrics=self.metrics, session=self.session)
+
+    def prefetch(self):
+        # Every market page of the union, once, into the shared cache
+        api = self.api(self.markets())
+        with ThreadPoolExecutor(max_workers=self.fetch_workers) as executor:
+            executor.submit(api.fetch_ssr_rate)
+            list(executor.map(api.fetch_market, api.markets))
+
+    def fetch_vault(self, vault):
+        # The vault's own positions pages are the only new calls; market and SSR pages come from the cache
+        data = self.api(vault['market_to_pool'].keys(), vault['target_wallet'], vault['vaults_url']).fetch_data()
+        idle_data = self.api(vault['idle_market_to_pool'].keys(), vault['target_wallet'],
+                             vault['vaults_url']).fetch_data()
+        return data, idle_data
+
+    def run(self):
+        """Fetch and analyse every vault; returns (pools, idles, overviews) frames keyed by vault name."""
+        self.prefetch()
+        with ThreadPoolExecutor(max_workers=self.fetch_workers) as executor:
+            fetched = list(executor.map(self.fetch_vault, self.vaults))
+
+        with self.metrics.timed('analyse_vaults') as record:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [executor.submit(analyse_vault, vault, data, idle_data)
+                           for vault, (data, idle_data) in zip(self.vaults, fetched)]
+                results = [future.result() for future in futures]
+            record['rows'] = len(results)
+
+        names = [vault['name'] for vault in self.vaults]
+        pools = pd.concat({name: pool_df for name, (pool_df, _, _) in zip(names, results)}, names=['Vault', 'Pool'])
+        idles = pd.concat({name: idle_df for name, (_, idle_df, _) in zip(names, results)}, names=['Vault', 'Pool'])
+        overviews = pd.concat({name: overview for name, (_, _, overview) in zip(names, results)},
+                              names=['Vault', 'Metric'])
+        return pools, idles, overviews
@@ -0,0 +1,167 @@
+import numpy as np
+import pandas as pd
+
+import irm
+from pool_engine import INPUT_COLUMNS, compute_pool_columns, truncate
+
+OBJECTIVES = ['yield', 'target']
+
+
+# Solves the whole allocation in one step instead of the SSR / withdrawal / deposit heuristics.
+# Each pool's allocation is bounded by the same rules the heuristics encode (Supply Cap, min_balance,
+# max_utilization, max_portion_to_withdraw), and the pools share the vault size as a budget.
+class AllocationOptimizer:
+    def __init__(self, pool_df, idle_df, realloc_metaparm):
+        self.pool_df = pool_df
+        self.idle_df = idle_df
+        self.realloc_metaparm = realloc_metaparm
+        self.total_vault_size = idle_df['Maker Allocation'].iloc[0] + pool_df['Maker Allocation'].sum()
+
+        columns = {name: pool_df[name].to_numpy(dtype=float) for name in INPUT_COLUMNS}
+        status = pool_df['Status'].to_numpy()
+        self.active = status == 'Active'
+        self.inactive = status == 'Inactive'
+        # The heuristic plan, for the comparison report
+        self.heuristic = compute_pool_columns(columns, self.active, self.inactive,
+                                              self.total_vault_size, realloc_metaparm)
+        self.total_supply = columns['Total Supply']
+        self.maker_allocation = columns['Maker Allocation']
+        self.supply_cap = columns['Supply Cap']
+        self.borrow_rate = columns['Borrow Rate']
+        self.total_borrow = self.heuristic['Total Borrow'].astype(float)
+        self.optimal_rate = self.heuristic['Optimal Rate']
+        self.target_borrow_rate = self.heuristic['Target Borrow Rate']
+        self.lower, self.upper = self.allocation_bounds()
+
+    def metaparm(self, key):
+        # Per-pool value of a realloc_metaparm key, picked by Status
+        return np.where(self.active, self.realloc_metaparm['active_pool'][key],
+                        self.realloc_metaparm['inactive_pool'][key])
+
+    def allocation_bounds(self):
+        # The most the vault may withdraw keeps min_balance, max_utilization and max_portion_to_withdraw
+        max_withdrawal = np.minimum.reduce([
+            self.maker_allocation,
+            self.total_supply * self.metaparm('max_portion_to_withdraw'),
+            np.maximum(self.total_supply - self.metaparm('min_balance'), 0),
+            np.maximum(self.total_supply - self.total_borrow / self.metaparm('max_utilization'), 0)])
+        lower = self.maker_allocation - max_withdrawal
+        # Only Active pools take deposits, up to their Supply Cap; Inactive pools are drained
+        upper = np.where(self.active, np.maximum(self.supply_cap, self.maker_allocation), lower)
+        return lower, upper
+
+    def pool_rates(self, allocation):
+        # Utilization and IRM borrow rate of each pool (first axis) if the vault held `allocation`
+        allocation = np.asarray(allocation, dtype=float)
+        pools = (slice(None),) + (None,) * (allocation.ndim - 1)
+        other_supply = (self.total_supply - self.maker_allocation)[pools]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            utilization = np.minimum(self.total_borrow[pools] / (other_supply + allocation), 1)
+        return utilization, irm.borrow_rate(self.optimal_rate[pools], utilization)
+
+    def objective(self, allocation, objective):
+        # Per-pool value of holding `allocation` (pools x candidates)
+        utilization, rate = self.pool_rates(allocation)
+        if objective == 'yield':
+            # Interest the vault earns: its share of the borrow (Maker Borrow) times the borrow rate
+            maker_borrow = np.where(allocation > 0, allocation * utilization, 0)
+            return np.nan_to_num(maker_borrow * rate)
+        if objective == 'target':
+            # Distance from the Target Borrow Rate, weighted by the pool's borrow
+            return -self.total_borrow[:, None] * (rate - self.target_borrow_rate[:, None]) ** 2
+        raise ValueError(f"Unknown objective: {objective}. Choose from {OBJECTIVES}")
+
+    def solve_grid(self, candidates, objective, iterations):
+        # Lagrangian relaxation of the shared budget: for a price lam every pool independently takes
+        # the candidate maximising value - lam * allocation, and lam is bisected until the pools fit
+        values = self.objective(candidates, objective)
+        rows = np.arange(len(candidates))
+
+        def choose(lam):
+            return candidates[rows, np.argmax(values - lam * candidates, axis=1)]
+
+        allocation = choose(0.0)
+        if allocation.sum() <= self.total_vault_size:
+            return allocation
+
+        # Above the steepest slope between neighbouring candidates every pool takes its lowest allocation
+        widths = np.diff(candidates, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slopes = np.where(widths > 0, np.diff(values, axis=1) / widths, 0)
+        low, high = 0.0, float(np.abs(slopes).max()) + 1.0
+        for _ in range(iterations):
+            lam = (low + high) / 2
+            if choose(lam).sum() > self.total_vault_size:
+                low = lam
+            else:
+                high = lam
+        return choose(high)
+
+    def solve(self, objective='yield', grid_size=513, iterations=60):
+        """Optimal allocation for every pool.
+
+        objective='yield' maximises the interest the vault earns, which is its Maker Borrow weighted
+        borrow rate; objective='target' steers every pool's rate to its Target Borrow Rate. A coarse
+        candidate grid between each pool's bounds is solved first and then refined around the result.
+        """
+        steps = np.linspace(0, 1, grid_size)
+        span = (self.upper - self.lower)[:, None]
+        candidates = np.concatenate([self.lower[:, None] + span * steps, self.maker_allocation[:, None]], axis=1)
+        candidates = np.clip(candidates, self.lower[:, None], self.upper[:, None])
+        allocation = self.solve_grid(candidates, objective, iterations)
+
+        step = span[:, 0] / (grid_size - 1)
+        refined = allocation[:, None] + step[:, None] * np.linspace(-1, 1, grid_size)
+        refined = np.clip(refined, self.lower[:, None], self.upper[:, None])
+        allocation = self.solve_grid(refined, objective, iterations)
+
+        return self.apply_significance_threshold(truncate(allocation))
+
+    def apply_significance_threshold(self, allocation):
+        # Moves within allocation_significance_threshold are skipped, like calculate_total_change does,
+        # as long as skipping a small withdrawal does not push the pools over the vault size
+        change = allocation - self.maker_allocation
+        small = np.abs(change) <= self.metaparm('allocation_significance_threshold')
+        allocation = np.where(small & (change > 0), self.maker_allocation, allocation)
+        slack = self.total_vault_size - allocation.sum()
+        for i in np.flatnonzero(small & (change < 0)):
+            if -change[i] <= slack:
+                allocation[i] = self.maker_allocation[i]
+                slack += change[i]
+        return truncate(allocation)
+
+    def compare(self, objective='yield', grid_size=513, iterations=60):
+        # Optimized plan next to the heuristic plan of update_pool_dataframe
+        allocation = self.solve(objective, grid_size, iterations)
+        utilization, rate = self.pool_rates(allocation.astype(float))
+        heuristic_allocation = self.heuristic['Final Allocation']
+        heuristic_utilization, heuristic_rate = self.pool_rates(heuristic_allocation.astype(float))
+
+        comparison = pd.DataFrame({
+            'Status': self.pool_df['Status'].to_numpy(),
+            'Maker Allocation': self.maker_allocation.astype(np.int64),
+            'Heuristic Allocation': heuristic_allocation,
+            'Optimized Allocation': allocation,
+            'Allocation Difference': allocation - heuristic_allocation,
+            'Heuristic Utilization': heuristic_utilization,
+            'Optimized Utilization': utilization,
+            'Heuristic Borrow Rate': heuristic_rate,
+            'Optimized Borrow Rate': rate,
+            'Target Borrow Rate': self.target_borrow_rate,
+        }, index=self.pool_df.index)
+        return comparison
+
+    @staticmethod
+    def summarize(comparison):
+        # Vault-level totals of a compare() table: allocation, Maker Borrow and its weighted rate
+        summary = {}
+        for plan in ['Heuristic', 'Optimized']:
+            allocation = comparison[f'{plan} Allocation']
+            maker_borrow = allocation * comparison[f'{plan} Utilization']
+            summary[plan] = {
+                'Total Non-Idle Allocation': allocation.sum(),
+                'Maker Borrow': maker_borrow.sum(),
+                'Maker Borrow Weighted Rate': (maker_borrow * comparison[f'{plan} Borrow Rate']).sum() / maker_borrow.sum(),
+                'Annual Interest': (maker_borrow * comparison[f'{plan} Borrow Rate']).sum(),
+            }
+        return pd.DataFrame(summary)
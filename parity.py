@@ -0,0 +1,85 @@
+import argparse
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+
+from benchmark import PARAMETERS, REALLOC_METAPARM, synthetic_markets
+from data_manipulation import (IDLE_COLUMNS, POOL_COLUMNS, PoolAnalysis, PoolDataHandler, set_statuses,
+                               set_vault_parameters)
+
+
+def synthetic_records(vault, market_to_pool):
+    # The ApiBA.fetch_data records of a synthetic_markets() vault, without the stub server
+    positions = {position['market_uid']: position for position in vault['positions']}
+    records = []
+    for market in market_to_pool:
+        market_data = vault['markets'][market][0]
+        records.append({
+            'market': market,
+            'total_supply': market_data['total_supply'],
+            'utilization': market_data['utilization'],
+            'borrow_rate': market_data['borrow_rate_apy'],
+            'maker_allocation': positions[market]['supply'],
+            'supply_cap': positions[market]['cap'],
+            'ssr_rate': vault['ssr_rate'],
+        })
+    return records
+
+
+def pool_frames(vault):
+    # Populated pool and idle frames with statuses and parameters set, as the notebook builds them
+    market_to_pool = vault['market_to_pool']
+    idle_market_to_pool = vault['idle_market_to_pool']
+    pools_df = pd.DataFrame(index=list(market_to_pool.values()), columns=POOL_COLUMNS)
+    idle_df = pd.DataFrame(index=list(idle_market_to_pool.values()), columns=IDLE_COLUMNS)
+    with contextlib.redirect_stdout(io.StringIO()):
+        pools_df = PoolDataHandler(pools_df, market_to_pool).populate_dataframe(
+            synthetic_records(vault, market_to_pool))
+        idle_df = PoolDataHandler(idle_df, idle_market_to_pool).populate_dataframe(
+            synthetic_records(vault, idle_market_to_pool))
+    set_statuses(pools_df, vault['statuses'])
+    set_vault_parameters(pools_df, PARAMETERS)
+    return pools_df, idle_df
+
+
+def compare_engines(pools_df, idle_df, realloc_metaparm=REALLOC_METAPARM):
+    """(column, pool, engine value, row-wise value) for every cell where the two paths differ."""
+    engine = PoolAnalysis(pools_df.copy(), idle_df, realloc_metaparm).update_pool_dataframe()
+    rowwise = PoolAnalysis(pools_df.copy(), idle_df, realloc_metaparm).update_pool_dataframe_rowwise()
+    mismatches = []
+    for column in engine.columns.drop('Status'):
+        a = engine[column].to_numpy(dtype=np.float64)
+        b = rowwise[column].to_numpy(dtype=np.float64)
+        for i in np.flatnonzero(~((a == b) | (np.isnan(a) & np.isnan(b)))):
+            mismatches.append((column, engine.index[i], float(a[i]), float(b[i])))
+    return mismatches
+
+
+def check_parity(seeds=range(20), n_markets=15):
+    # {seed: mismatches} for the seeds where the engine and the row-wise reference disagree
+    results = {}
+    for seed in seeds:
+        mismatches = compare_engines(*pool_frames(synthetic_markets(n_markets, seed)))
+        if mismatches:
+            results[seed] = mismatches
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check the columnar engine against the row-wise reference.')
+    parser.add_argument('--seeds', type=int, default=20, help='number of synthetic vaults')
+    parser.add_argument('--markets', type=int, default=15)
+    args = parser.parse_args(argv)
+
+    results = check_parity(range(args.seeds), args.markets)
+    for seed, mismatches in results.items():
+        for column, pool, engine, rowwise in mismatches:
+            print(f"Seed {seed}: {column} of {pool}: engine {engine!r}, row-wise {rowwise!r}")
+    print(f"{args.seeds - len(results)} of {args.seeds} synthetic vaults match exactly")
+    return 1 if results else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,339 @@
+from functools import reduce
+
+import numpy as np
+
+import irm
+
+# Columns read by the engine, as set by PoolDataHandler and the notebook's tweakable parameters
+INPUT_COLUMNS = [
+    'Total Supply',
+    'Maker Allocation',
+    'Utilization',
+    'Borrow Rate',
+    'Supply Cap',
+    'SSR',
+    'Fixed Spread',
+    'Fixed Slope',
+    'Proportional Spread',
+    'Proportional Slope',
+    'Low Target Threshold',
+    'High Target Threshold',
+]
+
+# Columns written by the engine, in the order PoolAnalysis.update_pool_dataframe fills them
+OUTPUT_COLUMNS = [
+    'Total Borrow',
+    'Maker Borrow',
+    'Optimal Rate',
+    'Capped Borrow Rate',
+    'Target Borrow Rate',
+    'Min Borrow Rate',
+    'Max Borrow Rate',
+    'Utilization Where Rate Equal to SSR',
+    'SSR Adjustment',
+    'Total Supply After SSR Adjustment',
+    'Maker Supply After SSR Adjustment',
+    'Utilization After SSR Adjustment',
+    'Inactive Withdrawal',
+    'Utilization Where Rate Equal To Min Target',
+    'Active Withdrawal',
+    'Utilization Where Rate Equal To Max Target',
+    'Active Deposits',
+    'Manual Adjustment',
+    'Total Change',
+    'Final Allocation',
+    'Final Supply',
+    'Final Utilization',
+    'Final Borrow Rate',
+    'Final Capped Rate',
+    'Maker Borrow at Old Utilization',
+    'Borrow Rate Change',
+]
+
+
+def round_half_even(values, ndigits):
+    # Same result as Python's round(): np.round scales by 10**ndigits first, which can
+    # push values sitting on a half the wrong way, so those few are rounded by Python
+    values = np.asarray(values, dtype=np.float64)
+    rounded = np.round(values, ndigits)
+    scaled = values * 10.0 ** ndigits
+    with np.errstate(invalid='ignore'):
+        distance = np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5)
+        suspect = distance < np.maximum(1e-6, np.abs(scaled) * 1e-12)
+    if suspect.any():
+        rounded[suspect] = [round(float(value), ndigits) for value in values[suspect]]
+    return rounded
+
+
+def truncate(values):
+    # Same result as Python's int() on each value
+    values = np.asarray(values, dtype=np.float64)
+    if not np.isfinite(values).all():
+        raise ValueError("cannot convert non-finite value to integer")
+    return np.trunc(values).astype(np.int64)
+
+
+def maximum(*arrays):
+    # Element-wise max of several arrays that only need to broadcast against each other
+    return reduce(np.maximum, arrays)
+
+
+def utilization_where_rate_equal_to(rate, optimal_rate):
+    return round_half_even(np.minimum(irm.utilization_at_rate(rate, optimal_rate), 1), 4)
+
+
+# One formula per derived column, mirroring the PoolAnalysis.calculate_* methods. `c` maps column
+# names to arrays (plus the 'Active' / 'Inactive' Status masks), `ctx` holds the vault-level values.
+def total_borrow(c, ctx):
+    return truncate(c['Total Supply'] * c['Utilization'])
+
+def maker_borrow(c, ctx):
+    return truncate(c['Total Borrow'] * (c['Maker Allocation'] / c['Total Supply']))
+
+def optimal_rate(c, ctx):
+    return round_half_even(irm.rate_at_target(c['Borrow Rate'], c['Utilization']), 4)
+
+def capped_borrow_rate(c, ctx):
+    return round_half_even(np.minimum(c['Borrow Rate'], c['Optimal Rate']), 4)
+
+def target_borrow_rate(c, ctx):
+    total_vault_size = ctx['total_vault_size']
+    return round_half_even(np.maximum(
+        c['SSR'] + c['Fixed Spread'] + total_vault_size * c['Fixed Slope'],
+        c['SSR'] * (1 + c['Proportional Spread']) * (1 + c['Proportional Slope'] * total_vault_size)), 4)
+
+def min_borrow_rate(c, ctx):
+    return round_half_even(c['Target Borrow Rate'] * c['Low Target Threshold'], 4)
+
+def max_borrow_rate(c, ctx):
+    return round_half_even(c['Target Borrow Rate'] * c['High Target Threshold'], 4)
+
+def utilization_where_rate_equal_to_ssr(c, ctx):
+    return utilization_where_rate_equal_to(c['SSR'], c['Optimal Rate'])
+
+def ssr_adjustment(c, ctx):
+    return truncate(np.minimum(maximum(
+        c['Total Borrow'] / c['Utilization Where Rate Equal to SSR'] - c['Total Supply'],
+        -c['Maker Allocation'],
+        ctx['realloc_metaparm']['inactive_pool']['min_balance'] - c['Total Supply']), 0))
+
+def total_supply_after_ssr_adjustment(c, ctx):
+    return truncate(c['Total Supply'] + c['SSR Adjustment'])
+
+def maker_supply_after_ssr_adjustment(c, ctx):
+    return truncate(c['Maker Allocation'] + c['SSR Adjustment'])
+
+def utilization_after_ssr_adjustment(c, ctx):
+    return round_half_even(c['Total Borrow'] / c['Total Supply After SSR Adjustment'], 4)
+
+def inactive_withdrawal(c, ctx):
+    inactive_pool = ctx['realloc_metaparm']['inactive_pool']
+    adjustment = np.minimum(maximum(
+        inactive_pool['min_balance'] - c['Total Supply After SSR Adjustment'],
+        c['Total Borrow'] / inactive_pool['max_utilization'] - c['Total Supply After SSR Adjustment'],
+        -c['Maker Supply After SSR Adjustment'],
+        -c['SSR Adjustment'] - c['Total Supply'] * inactive_pool['max_portion_to_withdraw']), 0)
+    return truncate(np.where(c['Inactive'], adjustment, 0))
+
+def utilization_where_rate_equal_to_min_target(c, ctx):
+    return utilization_where_rate_equal_to(c['Min Borrow Rate'], c['Optimal Rate'])
+
+def active_withdrawal(c, ctx):
+    active_pool = ctx['realloc_metaparm']['active_pool']
+    adjustment = np.minimum(maximum(
+        c['Total Borrow'] / active_pool['max_utilization'] - c['Total Supply'] - c['SSR Adjustment'],
+        -c['Maker Supply After SSR Adjustment'],
+        -c['SSR Adjustment'] - c['Total Supply'] * active_pool['max_portion_to_withdraw'],
+        active_pool['min_balance'] - c['Total Supply After SSR Adjustment'],
+        c['Total Borrow'] / c['Utilization Where Rate Equal To Min Target'] - c['Total Supply After SSR Adjustment']), 0)
+    return truncate(np.where(c['Active'] & ctx['yes_funds'], adjustment, 0))
+
+def utilization_where_rate_equal_to_max_target(c, ctx):
+    return utilization_where_rate_equal_to(c['Max Borrow Rate'], c['Optimal Rate'])
+
+def active_deposits(c, ctx):
+    deposits = np.maximum(np.minimum(
+        c['Total Borrow'] / c['Utilization Where Rate Equal To Max Target'] - c['Total Supply After SSR Adjustment'],
+        c['Supply Cap'] - c['Maker Supply After SSR Adjustment']), 0)
+    return np.where(c['Active'], deposits, 0.0)
+
+def manual_adjustment(c, ctx):
+    return np.zeros(np.shape(c['Active Deposits']), dtype=np.int64)
+
+def total_change(c, ctx):
+    total_sum = (c['SSR Adjustment'] + c['Inactive Withdrawal'] + c['Active Withdrawal']
+                 + c['Active Deposits'] + c['Manual Adjustment'])
+    return np.where(np.abs(total_sum) <= 10000, 0.0, total_sum)
+
+def final_allocation(c, ctx):
+    return truncate(c['Maker Allocation'] + c['Total Change'])
+
+def final_supply(c, ctx):
+    return truncate(c['Total Supply'] + c['Total Change'])
+
+def final_utilization(c, ctx):
+    return round_half_even(c['Total Borrow'] / c['Final Supply'], 4)
+
+def final_borrow_rate(c, ctx):
+    return round_half_even(irm.borrow_rate(c['Optimal Rate'], c['Final Utilization']), 4)
+
+def final_capped_rate(c, ctx):
+    return np.minimum(c['Final Borrow Rate'], c['Optimal Rate'])
+
+def maker_borrow_at_old_utilization(c, ctx):
+    return truncate(c['Final Allocation'] * c['Utilization'])
+
+def borrow_rate_change(c, ctx):
+    return c['Final Borrow Rate'] - c['Borrow Rate']
+
+
+# (column, columns it reads, formula) in evaluation order. 'Total Vault Size' and 'Realloc Metaparm'
+# stand for the vault-level values in ctx, so a change to them can be tracked like a column change.
+COLUMN_FORMULAS = [
+    ('Total Borrow', ['Total Supply', 'Utilization'], total_borrow),
+    ('Maker Borrow', ['Total Borrow', 'Maker Allocation', 'Total Supply'], maker_borrow),
+    ('Optimal Rate', ['Utilization', 'Borrow Rate'], optimal_rate),
+    ('Capped Borrow Rate', ['Borrow Rate', 'Optimal Rate'], capped_borrow_rate),
+    ('Target Borrow Rate', ['SSR', 'Fixed Spread', 'Fixed Slope', 'Proportional Spread',
+                            'Proportional Slope', 'Total Vault Size'], target_borrow_rate),
+    ('Min Borrow Rate', ['Target Borrow Rate', 'Low Target Threshold'], min_borrow_rate),
+    ('Max Borrow Rate', ['Target Borrow Rate', 'High Target Threshold'], max_borrow_rate),
+    ('Utilization Where Rate Equal to SSR', ['SSR', 'Optimal Rate'], utilization_where_rate_equal_to_ssr),
+    ('SSR Adjustment', ['Total Borrow', 'Utilization Where Rate Equal to SSR', 'Total Supply',
+                        'Maker Allocation', 'Realloc Metaparm'], ssr_adjustment),
+    ('Total Supply After SSR Adjustment', ['Total Supply', 'SSR Adjustment'], total_supply_after_ssr_adjustment),
+    ('Maker Supply After SSR Adjustment', ['Maker Allocation', 'SSR Adjustment'], maker_supply_after_ssr_adjustment),
+    ('Utilization After SSR Adjustment', ['Total Borrow', 'Total Supply After SSR Adjustment'],
+     utilization_after_ssr_adjustment),
+    ('Inactive Withdrawal', ['Inactive', 'Total Supply After SSR Adjustment', 'Total Borrow',
+                             'Maker Supply After SSR Adjustment', 'SSR Adjustment', 'Total Supply',
+                             'Realloc Metaparm'], inactive_withdrawal),
+    ('Utilization Where Rate Equal To Min Target', ['Min Borrow Rate', 'Optimal Rate'],
+     utilization_where_rate_equal_to_min_target),
+    ('Active Withdrawal', ['Active', 'Total Borrow', 'Total Supply', 'SSR Adjustment',
+                           'Maker Supply After SSR Adjustment', 'Total Supply After SSR Adjustment',
+                           'Utilization Where Rate Equal To Min Target', 'Realloc Metaparm'], active_withdrawal),
+    ('Utilization Where Rate Equal To Max Target', ['Max Borrow Rate', 'Optimal Rate'],
+     utilization_where_rate_equal_to_max_target),
+    ('Active Deposits', ['Active', 'Total Borrow', 'Utilization Where Rate Equal To Max Target',
+                         'Total Supply After SSR Adjustment', 'Supply Cap',
+                         'Maker Supply After SSR Adjustment'], active_deposits),
+    ('Manual Adjustment', ['Active Deposits'], manual_adjustment),
+    ('Total Change', ['SSR Adjustment', 'Inactive Withdrawal', 'Active Withdrawal', 'Active Deposits',
+                      'Manual Adjustment'], total_change),
+    ('Final Allocation', ['Maker Allocation', 'Total Change'], final_allocation),
+    ('Final Supply', ['Total Supply', 'Total Change'], final_supply),
+    ('Final Utilization', ['Total Borrow', 'Final Supply'], final_utilization),
+    ('Final Borrow Rate', ['Final Utilization', 'Optimal Rate'], final_borrow_rate),
+    ('Final Capped Rate', ['Final Borrow Rate', 'Optimal Rate'], final_capped_rate),
+    ('Maker Borrow at Old Utilization', ['Final Allocation', 'Utilization'], maker_borrow_at_old_utilization),
+    ('Borrow Rate Change', ['Final Borrow Rate', 'Borrow Rate'], borrow_rate_change),
+]
+
+
+def compute_pool_columns(columns, active, inactive, total_vault_size, realloc_metaparm, yes_funds=True):
+    """Compute every derived PoolAnalysis column at once.
+
+    `columns` maps each of INPUT_COLUMNS to an array, `active` and `inactive` are boolean
+    masks of the pool Status. Arrays may carry extra leading (scenario) dimensions as long
+    as they broadcast against each other; `total_vault_size` may be an array too.
+    """
+    c = {name: np.asarray(columns[name], dtype=np.float64) for name in INPUT_COLUMNS}
+    c['Active'] = np.asarray(active, dtype=bool)
+    c['Inactive'] = np.asarray(inactive, dtype=bool)
+    ctx = {'total_vault_size': total_vault_size, 'realloc_metaparm': realloc_metaparm, 'yes_funds': yes_funds}
+    out = {}
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for column, _, formula in COLUMN_FORMULAS:
+            out[column] = c[column] = formula(c, ctx)
+
+    return out
+
+
+# PoolOverview rows, in the order the notebook lists them
+OVERVIEW_METRICS = [
+    'Total Non-Idle Allocation',
+    'Supply Weighted LLTV',
+    'Supply Weighted sUSDe',
+    'Average Borrow Rate',
+    'Average Capped Rate',
+    'Rate at Prior Equilibrium',
+]
+OVERVIEW_COLUMNS = ['Current', 'Future', 'Change']
+
+
+# Per-pool products whose sums make up every overview metric; 'sUSDe' is 1 for sUSDe pools
+OVERVIEW_TERMS = {
+    'Maker Allocation': ('Maker Allocation',),
+    'Final Allocation': ('Final Allocation',),
+    'Maker Allocation x LLTV': ('Maker Allocation', 'LLTV'),
+    'Final Allocation x LLTV': ('Final Allocation', 'LLTV'),
+    'Maker Allocation x sUSDe': ('Maker Allocation', 'sUSDe'),
+    'Final Allocation x sUSDe': ('Final Allocation', 'sUSDe'),
+    'Maker Borrow': ('Maker Borrow',),
+    'Maker Borrow x Borrow Rate': ('Maker Borrow', 'Borrow Rate'),
+    'Maker Borrow x Final Borrow Rate': ('Maker Borrow', 'Final Borrow Rate'),
+    'Maker Borrow x Capped Borrow Rate': ('Maker Borrow', 'Capped Borrow Rate'),
+    'Maker Borrow x Final Capped Rate': ('Maker Borrow', 'Final Capped Rate'),
+}
+
+
+def overview_terms(columns):
+    terms = {}
+    for term, factors in OVERVIEW_TERMS.items():
+        values = np.asarray(columns[factors[0]], dtype=np.float64)
+        for factor in factors[1:]:
+            values = values * np.asarray(columns[factor], dtype=np.float64)
+        terms[term] = values
+    return terms
+
+
+def overview_from_sums(sums):
+    # Current and Future value of every PoolOverview metric from the pool sums of OVERVIEW_TERMS
+    s = sums
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_borrow_rate = s['Maker Borrow x Borrow Rate'] / s['Maker Borrow']
+        future_avg_borrow_rate = s['Maker Borrow x Final Borrow Rate'] / s['Maker Borrow']
+        overview = {
+            'Total Non-Idle Allocation': (s['Maker Allocation'], s['Final Allocation']),
+            'Supply Weighted LLTV': (
+                s['Maker Allocation x LLTV'] / s['Maker Allocation'],
+                s['Final Allocation x LLTV'] / s['Final Allocation']),
+            'Supply Weighted sUSDe': (
+                s['Maker Allocation x sUSDe'] / s['Maker Allocation'],
+                s['Final Allocation x sUSDe'] / s['Final Allocation']),
+            'Average Borrow Rate': (avg_borrow_rate, future_avg_borrow_rate),
+            'Average Capped Rate': (
+                s['Maker Borrow x Capped Borrow Rate'] / s['Maker Borrow'],
+                s['Maker Borrow x Final Capped Rate'] / s['Maker Borrow']),
+            # Same math as the average borrow rate, reported under its own name
+            'Rate at Prior Equilibrium': (avg_borrow_rate, future_avg_borrow_rate),
+        }
+    return overview
+
+
+def compute_overview(columns, lltv, is_susde):
+    """Current and Future value of every PoolOverview metric, reduced over the last (pool) axis.
+
+    `columns` maps Maker Allocation, Final Allocation, Maker Borrow, Borrow Rate, Final Borrow Rate,
+    Capped Borrow Rate and Final Capped Rate to arrays; `lltv` and `is_susde` are per-pool arrays.
+    """
+    columns = dict(columns, **{'LLTV': lltv, 'sUSDe': is_susde})
+    sums = {term: values.sum(axis=-1) for term, values in overview_terms(columns).items()}
+    return overview_from_sums(sums)
+
+
+def compute_change(current, future):
+    # Relative change, NaN where the current value is zero
+    current = np.asarray(current, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(current != 0, (np.asarray(future, dtype=np.float64) - current) / current, np.nan)
+
+
+def overview_table(sums):
+    # (..., metrics, 3) array of Current, Future and Change of every metric from the OVERVIEW_TERMS sums
+    overview = overview_from_sums(sums)
+    current = np.stack([np.asarray(overview[metric][0], dtype=np.float64) for metric in OVERVIEW_METRICS], axis=-1)
+    future = np.stack([np.asarray(overview[metric][1], dtype=np.float64) for metric in OVERVIEW_METRICS], axis=-1)
+    return np.stack([current, future, compute_change(current, future)], axis=-1)
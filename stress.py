@@ -0,0 +1,201 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import irm
+from pool_engine import max_borrow_rate, min_borrow_rate, target_borrow_rate
+
+# Shock model; every value can be overridden per run
+DEFAULT_SHOCKS = {
+    # Log-normal change of every market's borrow over the horizon, partly shared across markets
+    'borrow_volatility': 0.10,
+    'borrow_correlation': 0.5,
+    # Chance of a borrow surge per market, and the mean relative size of a surge (exponential)
+    'jump_probability': 0.02,
+    'jump_size': 0.25,
+    # Mean share of the other suppliers' funds withdrawn over the horizon (beta distributed)
+    'outflow_mean': 0.05,
+    # Standard deviation of the absolute SSR move, shared by every market
+    'ssr_volatility': 0.005,
+    # Days the rate at target drifts at the shocked utilization
+    'horizon_days': 1.0,
+}
+
+# Per-pool distributions are kept as histograms over these (low, high, bins), so chunks merge exactly;
+# quantiles are read to the bin width
+HISTOGRAM_BINS = {
+    'Final Utilization': (0.0, 1.0, 10000),
+    'Borrow Rate': (0.0, 1.0, 10000),
+    'Shortfall': (0.0, 1.0, 1000),
+    'Maker Locked': (0.0, 1.0, 1000),
+}
+QUANTILES = [0.01, 0.05, 0.5, 0.95, 0.99]
+
+
+def stress_inputs(pool_df, idle_df, allocation=None):
+    # The picklable per-pool arrays a worker needs, from an analysed pool frame
+    columns = ['Total Supply', 'Maker Allocation', 'Total Borrow', 'Optimal Rate', 'SSR', 'Fixed Spread',
+               'Fixed Slope', 'Proportional Spread', 'Proportional Slope', 'Low Target Threshold',
+               'High Target Threshold']
+    inputs = {name: pool_df[name].to_numpy(dtype=np.float64) for name in columns}
+    plan = pool_df['Final Allocation'] if allocation is None else allocation
+    inputs['Final Allocation'] = np.asarray(plan, dtype=np.float64)
+    inputs['Total Vault Size'] = float(idle_df['Maker Allocation'].iloc[0] + pool_df['Maker Allocation'].sum())
+    return inputs
+
+
+def simulate_paths(inputs, shocks, n_paths, seed):
+    """One (paths x pools) draw of every shocked quantity; `seed` is an int or a SeedSequence.
+
+    The other suppliers' funds shrink by the outflow and our funds are at their Final Allocation;
+    the borrow moves by the log-normal shock and any surge. Borrow the supply cannot cover is the
+    Shortfall (as a share of the borrow), and the part of our allocation that is lent out and cannot
+    be withdrawn is Maker Locked (as a share of the allocation).
+    """
+    rng = np.random.default_rng(seed)
+    n_pools = len(inputs['Total Supply'])
+    volatility = shocks['borrow_volatility']
+    correlation = shocks['borrow_correlation']
+
+    common = rng.standard_normal((n_paths, 1))
+    own = rng.standard_normal((n_paths, n_pools))
+    z = np.sqrt(correlation) * common + np.sqrt(1 - correlation) * own
+    borrow_shock = np.exp(volatility * z - volatility ** 2 / 2)
+    jumps = rng.random((n_paths, n_pools)) < shocks['jump_probability']
+    borrow_shock *= 1 + jumps * rng.exponential(shocks['jump_size'], (n_paths, n_pools))
+    borrow = inputs['Total Borrow'] * borrow_shock
+
+    outflow_mean = shocks['outflow_mean']
+    if outflow_mean > 0:
+        outflow = rng.beta(1, 1 / outflow_mean - 1, (n_paths, n_pools))
+    else:
+        outflow = np.zeros((n_paths, n_pools))
+    other_supply = inputs['Total Supply'] - inputs['Maker Allocation']
+    allocation = inputs['Final Allocation']
+    supply = other_supply * (1 - outflow) + allocation
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        demand = np.where(supply > 0, borrow / supply, 1.0)
+        utilization = np.minimum(demand, 1.0)
+        shortfall = np.where(borrow > 0, np.maximum(borrow - supply, 0) / borrow, 0.0)
+        liquidity = np.maximum(supply - borrow, 0)
+        locked = np.where(allocation > 0, np.maximum(allocation - liquidity, 0) / allocation, 0.0)
+
+    rate_at_target = irm.adapt_rate_at_target(inputs['Optimal Rate'], utilization,
+                                              shocks['horizon_days'] * irm.SECONDS_PER_DAY)[0]
+    rate = irm.borrow_rate(rate_at_target, utilization)
+
+    # The target band moves with the SSR, through the same formulas as PoolAnalysis
+    ssr = np.maximum(inputs['SSR'] + shocks['ssr_volatility'] * rng.standard_normal((n_paths, 1)), 0)
+    c = {name: inputs[name] for name in ['Fixed Spread', 'Fixed Slope', 'Proportional Spread', 'Proportional Slope',
+                                         'Low Target Threshold', 'High Target Threshold']}
+    c['SSR'] = ssr
+    c['Target Borrow Rate'] = target_borrow_rate(c, {'total_vault_size': inputs['Total Vault Size']})
+    within = (rate >= min_borrow_rate(c, {})) & (rate <= max_borrow_rate(c, {}))
+
+    return {
+        'Final Utilization': utilization,
+        'Borrow Rate': rate,
+        'Shortfall': shortfall,
+        'Maker Locked': locked,
+        'Within Target': within,
+        'Maker Locked Amount': locked * allocation,
+    }
+
+
+def histogram(values, low, high, bins):
+    # (pools, bins + 1) counts of a (paths x pools) array; the last column counts the values at or above `high`
+    n_pools = values.shape[1]
+    index = np.clip(((values - low) * (bins / (high - low))).astype(np.int64), 0, bins)
+    flat = index + np.arange(n_pools) * (bins + 1)
+    return np.bincount(flat.ravel(), minlength=n_pools * (bins + 1)).reshape(n_pools, bins + 1)
+
+
+def stress_chunk(inputs, shocks, n_paths, seed):
+    # Worker: the histograms and sums of one chunk of paths, small enough to send back
+    paths = simulate_paths(inputs, shocks, n_paths, seed)
+    summary = {name: histogram(paths[name], *bins) for name, bins in HISTOGRAM_BINS.items()}
+    summary['sums'] = {name: paths[name].sum(axis=0) for name in HISTOGRAM_BINS}
+    summary['shortfall_paths'] = (paths['Shortfall'] > 0).sum(axis=0)
+    summary['within_target'] = paths['Within Target'].sum(axis=0)
+    total_allocation = inputs['Final Allocation'].sum()
+    vault_locked = paths['Maker Locked Amount'].sum(axis=1) / total_allocation if total_allocation > 0 \
+        else np.zeros(n_paths)
+    summary['vault_locked'] = histogram(vault_locked[:, None], *HISTOGRAM_BINS['Maker Locked'])[0]
+    summary['paths'] = n_paths
+    return summary
+
+
+def histogram_quantiles(counts, low, high, quantiles):
+    # Lower edge of the bin holding each quantile, per row of counts; the overflow bin reads as `high`
+    bins = counts.shape[-1] - 1
+    cumulative = np.cumsum(counts, axis=-1)
+    targets = np.asarray(quantiles)[None, :] * cumulative[..., -1:]
+    index = np.array([np.searchsorted(row, target) for row, target in zip(cumulative, targets)])
+    return low + np.minimum(index, bins) * (high - low) / bins
+
+
+# Merged outcome of a stress run
+class StressResult:
+    def __init__(self, pools, chunks):
+        self.pools = pools
+        self.paths = sum(chunk['paths'] for chunk in chunks)
+        self.histograms = {name: sum(chunk[name] for chunk in chunks) for name in HISTOGRAM_BINS}
+        self.sums = {name: sum(chunk['sums'][name] for chunk in chunks) for name in HISTOGRAM_BINS}
+        self.shortfall_paths = sum(chunk['shortfall_paths'] for chunk in chunks)
+        self.within_target = sum(chunk['within_target'] for chunk in chunks)
+        self.vault_locked = sum(chunk['vault_locked'] for chunk in chunks)
+
+    def quantiles(self, name, quantiles=QUANTILES):
+        values = histogram_quantiles(self.histograms[name], *HISTOGRAM_BINS[name][:2], quantiles)
+        return pd.DataFrame(values, index=self.pools, columns=[f'{name} p{round(q * 100)}' for q in quantiles])
+
+    def summary(self):
+        """Per pool: mean and quantiles of every distribution, and the shortfall and target-band odds."""
+        frames = []
+        for name in HISTOGRAM_BINS:
+            frame = self.quantiles(name)
+            frame.insert(0, f'{name} Mean', self.sums[name] / self.paths)
+            frames.append(frame)
+        summary = pd.concat(frames, axis=1)
+        summary['Shortfall Probability'] = self.shortfall_paths / self.paths
+        summary['Within Target Probability'] = self.within_target / self.paths
+        return summary
+
+    def vault_summary(self, quantiles=QUANTILES):
+        # Share of the whole plan that is locked, across paths
+        values = histogram_quantiles(self.vault_locked[None, :], *HISTOGRAM_BINS['Maker Locked'][:2], quantiles)[0]
+        return pd.Series(values, index=[f'Vault Maker Locked p{round(q * 100)}' for q in quantiles])
+
+
+# Monte Carlo stress test of a reallocation plan under borrow, withdrawal and SSR shocks.
+# Paths are drawn in fixed-size chunks, each from its own child of one SeedSequence, so a run gives
+# the same result for a seed whatever the number of worker processes.
+class StressTest:
+    def __init__(self, pool_df, idle_df, allocation=None, shocks=None):
+        self.pools = list(pool_df.index)
+        self.inputs = stress_inputs(pool_df, idle_df, allocation)
+        self.shocks = dict(DEFAULT_SHOCKS, **(shocks or {}))
+        unknown = set(self.shocks) - set(DEFAULT_SHOCKS)
+        if unknown:
+            raise ValueError(f"Unknown shocks: {sorted(unknown)}. Choose from {list(DEFAULT_SHOCKS)}")
+
+    def paths(self, n_paths, seed=0):
+        # Raw (paths x pools) arrays, for small runs and plots
+        return simulate_paths(self.inputs, self.shocks, n_paths, seed)
+
+    def run(self, n_paths=1000000, seed=0, chunk_size=20000, max_workers=None):
+        sizes = [chunk_size] * (n_paths // chunk_size)
+        if n_paths % chunk_size:
+            sizes.append(n_paths % chunk_size)
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+        tasks = [(self.inputs, self.shocks, size, child) for size, child in zip(sizes, seeds)]
+
+        if max_workers == 1 or len(tasks) == 1:
+            chunks = [stress_chunk(*task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                # map keeps the chunks in seed order, so the float sums come out the same every run
+                chunks = list(executor.map(stress_chunk, *zip(*tasks)))
+        return StressResult(self.pools, chunks)
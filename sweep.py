@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+
+from data_manipulation import VAULT_PARAMETERS
+from pool_engine import INPUT_COLUMNS, OVERVIEW_METRICS, compute_change, compute_overview, compute_pool_columns
+
+# Tweakable pool parameters that can be swept, as named in the notebook
+POOL_PARAMETERS = VAULT_PARAMETERS
+
+# Reallocation metaparameters that can be swept, named '<pool type>.<key>' after realloc_metaparm
+REALLOC_PARAMETERS = [
+    f'{pool_type}.{key}'
+    for pool_type in ['active_pool', 'inactive_pool']
+    for key in ['min_balance', 'max_utilization', 'max_portion_to_withdraw']
+]
+
+
+# Result of a sweep: one row of parameters and one row of pool values per scenario
+class SweepResult:
+    def __init__(self, pools, parameters, final_allocation, total_change, overview):
+        self.pools = pools
+        self.parameters = parameters
+        self.final_allocation = final_allocation
+        self.total_change = total_change
+        self.overview = overview
+
+    def final_allocation_frame(self):
+        return pd.DataFrame(self.final_allocation, index=self.parameters.index, columns=self.pools)
+
+    def total_change_frame(self):
+        return pd.DataFrame(self.total_change, index=self.parameters.index, columns=self.pools)
+
+    def overview_frame(self):
+        # Parameters plus the Current, Future and Change value of every overview metric
+        frame = self.parameters.copy()
+        for metric in OVERVIEW_METRICS:
+            current, future = self.overview[metric]
+            frame[f'{metric} Current'] = current
+            frame[f'{metric} Future'] = future
+            frame[f'{metric} Change'] = compute_change(current, future)
+        return frame
+
+
+# Evaluates PoolAnalysis for every combination of a parameter grid in broadcast (scenarios x pools) passes
+class ParameterSweep:
+    def __init__(self, pool_df, idle_df, realloc_metaparm):
+        self.pool_df = pool_df
+        self.realloc_metaparm = realloc_metaparm
+        self.total_vault_size = idle_df['Maker Allocation'].iloc[0] + pool_df['Maker Allocation'].sum()
+        self.columns = {name: pool_df[name].to_numpy(dtype=float) for name in INPUT_COLUMNS + POOL_PARAMETERS}
+        status = pool_df['Status'].to_numpy()
+        self.active = status == 'Active'
+        self.inactive = status == 'Inactive'
+        self.lltv = pool_df['LLTV'].to_numpy(dtype=float)
+        self.is_susde = pool_df.index.str.startswith('sUSDe')
+
+    def scenario_grid(self, grid):
+        names = list(grid)
+        for name in names:
+            if name not in POOL_PARAMETERS and name not in REALLOC_PARAMETERS:
+                raise KeyError(f"Unknown sweep parameter: {name}")
+        values = [np.asarray(grid[name], dtype=float).ravel() for name in names]
+        return names, values
+
+    def evaluate(self, parameters):
+        # One broadcast pass over a chunk; `parameters` maps names to arrays of length n_scenarios
+        columns = dict(self.columns)
+        for name in POOL_PARAMETERS:
+            if name in parameters:
+                columns[name] = parameters[name][:, None]
+        columns['Fixed Slope'] = columns['Fixed Slope per 100M'] / 100000000
+        columns['Proportional Slope'] = columns['Proportional Slope per 100M'] / 100000000
+
+        realloc_metaparm = {pool_type: dict(values) for pool_type, values in self.realloc_metaparm.items()}
+        for name in REALLOC_PARAMETERS:
+            if name in parameters:
+                pool_type, key = name.split('.')
+                realloc_metaparm[pool_type][key] = parameters[name][:, None]
+
+        results = compute_pool_columns(columns, self.active, self.inactive, self.total_vault_size, realloc_metaparm)
+        n_scenarios = len(next(iter(parameters.values()))) if parameters else 1
+        shape = (n_scenarios, len(self.pool_df))
+        results = {name: np.broadcast_to(values, shape) for name, values in results.items()}
+        results['Maker Allocation'] = np.broadcast_to(columns['Maker Allocation'], shape)
+        results['Borrow Rate'] = np.broadcast_to(columns['Borrow Rate'], shape)
+        return results
+
+    def run(self, grid, chunk_size=10000):
+        """Evaluate every combination of the values in `grid`.
+
+        `grid` maps names from POOL_PARAMETERS or REALLOC_PARAMETERS to the values to try; anything
+        not in the grid keeps its value from the pool frame or realloc_metaparm. Scenarios are
+        evaluated `chunk_size` at a time so memory stays bounded.
+        """
+        names, values = self.scenario_grid(grid)
+        grid_shape = tuple(len(v) for v in values)
+        n_scenarios = int(np.prod(grid_shape))
+        n_pools = len(self.pool_df)
+
+        parameter_values = np.empty((n_scenarios, len(names)))
+        final_allocation = np.empty((n_scenarios, n_pools), dtype=np.int64)
+        total_change = np.empty((n_scenarios, n_pools))
+        overview = {metric: (np.empty(n_scenarios), np.empty(n_scenarios)) for metric in OVERVIEW_METRICS}
+
+        for start in range(0, n_scenarios, chunk_size):
+            stop = min(start + chunk_size, n_scenarios)
+            indices = np.unravel_index(np.arange(start, stop), grid_shape) if names else ()
+            chunk = {name: values[i][indices[i]] for i, name in enumerate(names)}
+            results = self.evaluate(chunk)
+
+            for i, name in enumerate(names):
+                parameter_values[start:stop, i] = chunk[name]
+            final_allocation[start:stop] = results['Final Allocation']
+            total_change[start:stop] = results['Total Change']
+            chunk_overview = compute_overview(results, self.lltv, self.is_susde)
+            for metric, (current, future) in chunk_overview.items():
+                overview[metric][0][start:stop] = current
+                overview[metric][1][start:stop] = future
+
+        parameters = pd.DataFrame(parameter_values, columns=names)
+        parameters.index.name = 'Scenario'
+        return SweepResult(list(self.pool_df.index), parameters, final_allocation, total_change, overview)